@@ -0,0 +1,48 @@
+from typing import Any, Dict, Iterator, Tuple
+import json
+
+
+def stage_timings(report: Dict[str, Any]) -> Iterator[Tuple[Tuple[int, str, str], Dict[str, float]]]:
+    """
+    ((cases, mode, stage), stats) of every timed stage of a benchmark report,
+    the stages run once per size have the mode "-"
+    """
+    for result in report['results']:
+        for stage, stats in result['stages'].items():
+            yield (result['cases'], "-", stage), stats
+        for mode, stages in result['modes'].items():
+            for stage, stats in stages.items():
+                yield (result['cases'], mode, stage), stats
+
+
+def compare_reports(baseline: Dict[str, Any], candidate: Dict[str, Any], metric: str = "p50_ms") -> str:
+    """
+    Table of the metric of every stage found in both reports, with the candidate / baseline ratio
+    """
+    baseline_stats = dict(stage_timings(baseline))
+    lines = [f"baseline  {(baseline.get('commit') or '?')[:10]}  {baseline.get('created')}",
+             f"candidate {(candidate.get('commit') or '?')[:10]}  {candidate.get('created')}",
+             f"{'cases':>8} {'mode':<7} {'stage':<22} {'baseline':>10} {'candidate':>10} {'ratio':>7}"]
+    for key, stats in stage_timings(candidate):
+        if key not in baseline_stats or not baseline_stats[key].get(metric) or stats.get(metric) is None:
+            continue
+        old, new = baseline_stats[key][metric], stats[metric]
+        cases, mode, stage = key
+        lines.append(f"{cases:>8} {mode:<7} {stage:<22} {old:>10.2f} {new:>10.2f} {new / old:>7.2f}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports of benchmarks.run")
+    parser.add_argument("baseline", type=str)
+    parser.add_argument("candidate", type=str)
+    parser.add_argument("--metric", type=str, default="p50_ms", choices=["mean_ms", "p50_ms", "p95_ms", "max_ms", "peak_rss_mb"])
+    args = parser.parse_args()
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, "r", encoding="utf-8") as f:
+        candidate = json.load(f)
+    print(compare_reports(baseline, candidate, args.metric))
@@ -0,0 +1,220 @@
+from benchmarks.synthetic import SyntheticSpec, synthetic_index, VOCABULARY
+from retrieval.query import load_database, query_handler
+from retrieval.fusion_query import fusion_query, embed_query_set, rrf_fusion
+from retrieval.text_query import text_based_query
+from retrieval.multi_modal_query import multi_modal_query
+from server.results_to_html import results_to_html_dict
+from utils.app_types import EnrichedQuery, QuerySet, default_filter_weights
+from utils.embedding_cache import configure_embedding_cache
+from utils.providers import configure_provider
+from utils.quantization import PRECISIONS
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+import multiprocessing
+import subprocess
+import platform
+import resource
+import logging
+import time
+import json
+import sys
+import numpy as np
+
+
+MODES = ["text", "image", "fusion", "random"]
+
+# the query path logs every query set at INFO, which would end up in the timings
+logger = logging.getLogger("benchmarks")
+
+
+def _reset_peak_memory() -> None:
+    # Linux resets the VmHWM high-water mark on writing 5 to clear_refs
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_memory_mb() -> float:
+    """
+    Peak resident memory since the last reset, the process peak where it cannot be reset
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def timed(fn: Callable[[Any], Any], inputs: List[Any]) -> Tuple[List[Any], Dict[str, float]]:
+    """
+    Call fn on every input, return the outputs and the timing and peak memory of the calls
+    """
+    _reset_peak_memory()
+    outputs, durations = [], []
+    for item in inputs:
+        start = time.perf_counter()
+        outputs.append(fn(item))
+        durations.append(time.perf_counter() - start)
+    durations_ms = np.array(durations) * 1000
+    return outputs, {
+        'runs': len(durations),
+        'mean_ms': float(durations_ms.mean()) if len(durations) else None,
+        'p50_ms': float(np.percentile(durations_ms, 50)) if len(durations) else None,
+        'p95_ms': float(np.percentile(durations_ms, 95)) if len(durations) else None,
+        'max_ms': float(durations_ms.max()) if len(durations) else None,
+        'peak_rss_mb': _peak_memory_mb(),
+    }
+
+
+def synthetic_queries(count: int, words: int, seed: int = 0) -> List[str]:
+    rng = np.random.default_rng(seed + 1)
+    return [" ".join(VOCABULARY[i] for i in rng.integers(len(VOCABULARY), size=words)) for _ in range(count)]
+
+
+def _query_set(query: str) -> QuerySet:
+    return QuerySet([EnrichedQuery(query, weights=default_filter_weights)], [1.0])
+
+
+def benchmark_size(case_count: int, options: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Generate (or reuse) the synthetic index of case_count cases and time every stage on it
+    """
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+    configure_provider("local", latency=options['latency'])
+    spec = SyntheticSpec(case_count, seed=options['seed'], sentence_words=options['sentence_words'],
+                         chunk_words=options['chunk_words'], precision=options['precision'],
+                         keep_exact=options['exact'], sketch=options['sketch'], ann=options['ann'])
+    index_path = Path(options['data']) / f"synthetic_{case_count}"
+
+    stages: Dict[str, Any] = {}
+    generated, stages['generate'] = timed(lambda spec: synthetic_index(index_path, spec), [spec])
+    databases, stages['load_database'] = timed(load_database, [str(index_path)])
+    database = databases[0]
+    bundle = database.index
+    result = {
+        'cases': case_count,
+        'text_rows': len(bundle.text_embeddings),
+        'image_rows': len(bundle.image_embeddings),
+        'index_mb': sum(p.stat().st_size for p in index_path.rglob("*") if p.is_file()) / 2 ** 20,
+        'generated': generated[0],
+        'stages': stages,
+        'modes': {},
+    }
+    logger.info(f"{case_count} cases: {result['text_rows']} text rows, {result['image_rows']} image rows")
+
+    search_options = {'nprobe': options['nprobe'], 'rerank': options['rerank'], 'shortlist': options['shortlist']}
+    queries = synthetic_queries(options['queries'], options['query_words'], options['seed'])
+    full_queries = queries[:options['full_queries']]
+    k = options['k']
+    for mode in options['modes']:
+        # a fresh cache for every mode, so that each mode embeds its queries
+        configure_embedding_cache(None, 4096)
+        mode_stages: Dict[str, Any] = {}
+        if mode == "random":
+            query_sets = [_query_set(query) for query in queries]
+        else:
+            query_sets, mode_stages['embed'] = timed(lambda query: embed_query_set(_query_set(query)), queries)
+        # the first query pays for paging in the memory mapped matrices
+        fusion_query(database, query_sets[0], mode=mode, k=k, **search_options)
+        pages, mode_stages['fusion_query'] = timed(
+            lambda query_set: (fusion_query(database, query_set, mode=mode, k=k, **search_options), query_set),
+            query_sets)
+        _, mode_stages['results_to_html_dict'] = timed(
+            lambda page: results_to_html_dict(page[0][0], page[1], page[0][1], 0), pages)
+        _, mode_stages['query_handler'] = timed(
+            lambda query: query_handler(database, query, k=k, mode=mode, **search_options), queries)
+
+        # the older full-list paths, they build a result for every case
+        full_sets = query_sets[:len(full_queries)]
+        if mode == "text":
+            _, mode_stages['text_based_query'] = timed(
+                lambda query_set: text_based_query(database, query_set.queries[0], **search_options), full_sets)
+        elif mode == "image":
+            _, mode_stages['multi_modal_query'] = timed(
+                lambda query_set: multi_modal_query(database, query_set.queries[0], **search_options), full_sets)
+        elif mode == "fusion":
+            result_lists = [(text_based_query(database, query_set.queries[0], **search_options),
+                             multi_modal_query(database, query_set.queries[0], **search_options))
+                            for query_set in full_sets]
+            _, mode_stages['rrf_fusion'] = timed(
+                lambda result_list: rrf_fusion(database, result_list[0], result_list[1]), result_lists)
+        result['modes'][mode] = mode_stages
+        logger.info(f"{case_count} cases, {mode}: fusion_query p50 {mode_stages['fusion_query']['p50_ms']:.1f} ms")
+    return result
+
+
+def _git_state() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return {'commit': commit, 'dirty': dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'dirty': None}
+
+
+def run_benchmarks(options: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Benchmark every size in its own process, so that the memory of one size does not carry over
+    """
+    report = {
+        **_git_state(),
+        'created': datetime.now().isoformat(timespec="seconds"),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': multiprocessing.cpu_count(),
+        'options': options,
+        'results': [],
+    }
+    for case_count in options['sizes']:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            report['results'].append(executor.submit(benchmark_size, case_count, options).result())
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark build, load and query stages on synthetic indexes, offline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Case counts")
+    parser.add_argument("--modes", type=str, nargs="+", default=MODES, choices=MODES)
+    parser.add_argument("--data", type=str, default="bench_data", help="Folder of the generated indexes, reused across runs")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Result json, bench_results/<commit>-<time>.json by default")
+    parser.add_argument("--queries", type=int, default=20, help="Queries timed per mode")
+    parser.add_argument("--full-queries", type=int, default=3,
+                        help="Queries timed on text_based_query, multi_modal_query and rrf_fusion")
+    parser.add_argument("--query-words", type=int, default=4)
+    parser.add_argument("--k", type=int, default=30, help="Page size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the local provider waits on every call")
+    parser.add_argument("--sentence-words", type=int, default=14, help="Words per answer sentence")
+    parser.add_argument("--chunk-words", type=int, default=70, help="Words per description chunk")
+    parser.add_argument("--precision", type=str, default="float32", choices=PRECISIONS)
+    parser.add_argument("--exact", action="store_true")
+    parser.add_argument("--sketch", action="store_true")
+    parser.add_argument("--ann", action="store_true")
+    parser.add_argument("--nprobe", type=int, default=None)
+    parser.add_argument("--rerank", type=int, default=None)
+    parser.add_argument("--shortlist", type=int, default=None)
+    args = parser.parse_args()
+
+    report = run_benchmarks(vars(args))
+    output = args.output or f"bench_results/{(report['commit'] or 'nogit')[:10]}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Saved the results to {output}")
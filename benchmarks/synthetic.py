@@ -0,0 +1,221 @@
+from utils.app_types import DesignCase, AssetItem, RawTextItem, BaseQuestion, TopicCategory, AssetCategory
+from utils.index_bundle import IndexBundle, MATRIX_FIELDS, SKETCH_FIELDS, build_bundle, sketch_bundle, \
+    quantize_bundle, save_bundle, bundle_exists
+from utils.quantization import QuantizedMatrix, stored_rows
+from utils.ann_index import build_ivf
+from utils.providers import word_vector, MULTI_MODAL_DIMENSIONS
+from utils.llm import EMBEDDING_MODEL, EMBEDDING_DIMENSIONS
+from utils.replicate_api import IMAGEBIND_MODEL
+from dataclasses import dataclass, asdict
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Tuple
+import numpy as np
+import logging
+import shutil
+import json
+import uuid
+
+
+SPEC_FILE = "synthetic.json"
+
+# words of the synthetic texts, queries made of them find the cases that use them
+VOCABULARY = [
+    "brick", "concrete", "timber", "glass", "steel", "stone", "marble", "copper", "zinc", "clay",
+    "plaster", "terrazzo", "bamboo", "granite", "limestone", "render", "tile", "slate", "oak", "pine",
+    "courtyard", "atrium", "facade", "cantilever", "roof", "terrace", "column", "arch", "vault", "ramp",
+    "stair", "canopy", "balcony", "loggia", "colonnade", "dome", "skylight", "window", "wall", "floor",
+    "corridor", "hall", "gallery", "library", "museum", "school", "chapel", "house", "tower", "pavilion",
+    "light", "shadow", "rhythm", "texture", "proportion", "scale", "symmetry", "void", "mass", "grid",
+    "landscape", "street", "garden", "river", "hill", "city", "village", "coast", "forest", "lake",
+    "calm", "bold", "monolithic", "playful", "austere", "warm", "open", "intimate", "modular", "fluid",
+    "ventilation", "insulation", "shading", "daylight", "thermal", "solar", "rainwater", "orientation",
+    "the", "a", "of", "and", "with", "through", "between", "along", "above", "under", "toward", "into",
+]
+TOPICS = list(TopicCategory.__args__)
+IMAGE_CATEGORIES = [category for category in AssetCategory.__args__ if category != "text"]
+
+
+@dataclass
+class SyntheticSpec:
+    """
+    Shape of a synthetic index. The defaults follow data/example_index:
+    2 to 6 images per case with 1 to 3 answer sentences per topic,
+    and a description of 8 to 35 chunks.
+    """
+    case_count: int
+    seed: int = 0
+    images: Tuple[int, int] = (2, 6)
+    answers: Tuple[int, int] = (1, 3)
+    chunks: Tuple[int, int] = (8, 35)
+    sentence_words: int = 14
+    chunk_words: int = 70
+    precision: str = "float32"
+    keep_exact: bool = False
+    sketch: bool = False
+    ann: bool = False
+
+    def to_dict(self) -> Dict:
+        return json.loads(json.dumps(asdict(self)))
+
+
+def _words(rng: np.random.Generator, count: int) -> str:
+    return " ".join(VOCABULARY[i] for i in rng.integers(len(VOCABULARY), size=count))
+
+
+def synthetic_case(rng: np.random.Generator, case_idx: int, spec: SyntheticSpec) -> DesignCase:
+    """
+    Case with random texts and answers, without embeddings
+    """
+    folder = Path("data/synthetic") / f"case_{case_idx:06d}"
+    content = []
+    chunk_count = int(rng.integers(spec.chunks[0], spec.chunks[1] + 1))
+    chunks = [_words(rng, spec.chunk_words) for _ in range(chunk_count)]
+    content.append(RawTextItem(folder / "description.txt", " ".join(chunks), chunks))
+    for image_idx in range(int(rng.integers(spec.images[0], spec.images[1] + 1))):
+        answers = OrderedDict()
+        for topic in TOPICS:
+            answer_count = int(rng.integers(spec.answers[0], spec.answers[1] + 1))
+            answers[BaseQuestion(topic)] = [_words(rng, spec.sentence_words) for _ in range(answer_count)]
+        category = IMAGE_CATEGORIES[int(rng.integers(len(IMAGE_CATEGORIES)))]
+        content.append(AssetItem(folder / f"image_{image_idx}.jpg", category, answers))
+    return DesignCase(str(uuid.UUID(int=int(rng.integers(2 ** 63)))), f"Synthetic case {case_idx}",
+                      folder, f"https://example.org/case/{case_idx}", content)
+
+
+class _WordVectors:
+    """
+    Per-word vectors of the local provider, a text embeds as the normalized sum of its word vectors,
+    the same as utils.providers.LocalProvider so that its query embeddings match the synthetic rows
+    """
+    def __init__(self, model: str, dimensions: int):
+        # the last row stays zero, it pads the shorter texts
+        self.vectors = np.zeros((len(VOCABULARY) + 1, dimensions), dtype=np.float32)
+        for word_idx, word in enumerate(VOCABULARY):
+            self.vectors[word_idx] = word_vector(word, model, dimensions)
+        self.word_index = {word: word_idx for word_idx, word in enumerate(VOCABULARY)}
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        words = [text.split() for text in texts]
+        ids = np.full((len(texts), max((len(w) for w in words), default=0)), len(VOCABULARY), dtype=np.int64)
+        for row, text_words in enumerate(words):
+            ids[row, :len(text_words)] = [self.word_index[word] for word in text_words]
+        embeddings = np.zeros((len(texts), self.vectors.shape[1]), dtype=np.float32)
+        for position in range(ids.shape[1]):
+            embeddings += self.vectors[ids[:, position]]
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.where(norms == 0, 1, norms)
+
+
+class _RowWriter:
+    """
+    Rows appended to a raw file, opened as a memmap once complete
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        self.file = open(path, "wb")
+        self.dtype, self.row_shape, self.rows = None, (), 0
+
+    def append(self, rows: np.ndarray) -> None:
+        rows = np.ascontiguousarray(rows)
+        self.dtype, self.row_shape = rows.dtype, rows.shape[1:]
+        self.rows += len(rows)
+        self.file.write(rows.tobytes())
+
+    def open(self) -> np.ndarray:
+        self.file.close()
+        if self.rows == 0:
+            return np.zeros((0, ) + self.row_shape, dtype=self.dtype or np.float32)
+        return np.memmap(self.path, dtype=self.dtype, mode="r", shape=(self.rows, ) + self.row_shape)
+
+
+def _chunk_bundle(cases: List[DesignCase], spec: SyntheticSpec, rng: np.random.Generator,
+                  text_vectors: _WordVectors, mm_vectors: _WordVectors) -> IndexBundle:
+    for case in cases:
+        texts = case.get_all_text()
+        case.embeddings = text_vectors.embed(texts)
+        case.multi_modal_embeddings = mm_vectors.embed(texts)
+        images = rng.standard_normal((len(case.get_all_image_paths()), MULTI_MODAL_DIMENSIONS)).astype(np.float32)
+        case.set_all_image_embeddings(list(images))
+    bundle = build_bundle(cases)
+    if spec.sketch:
+        bundle = sketch_bundle(bundle)
+    return quantize_bundle(bundle, spec.precision, spec.keep_exact)
+
+
+def write_synthetic_index(index_folder_path: str, spec: SyntheticSpec, chunk_cases: int = 500) -> Path:
+    """
+    Generate the cases chunk by chunk and write them as an index bundle.
+    The rows go through scratch files so the whole index never has to fit in memory.
+    """
+    index_folder_path = Path(index_folder_path)
+    scratch_path = index_folder_path / f"scratch-{uuid.uuid4().hex[:8]}"
+    scratch_path.mkdir(parents=True)
+    rng = np.random.default_rng(spec.seed)
+    text_vectors = _WordVectors(EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
+    mm_vectors = _WordVectors(IMAGEBIND_MODEL, MULTI_MODAL_DIMENSIONS)
+
+    writers: Dict[str, _RowWriter] = {}
+    def append(name: str, rows: np.ndarray) -> None:
+        if name not in writers:
+            writers[name] = _RowWriter(scratch_path / f"{name}.raw")
+        writers[name].append(rows)
+
+    cases_meta = []
+    text_offsets, image_offsets = [np.zeros(1, dtype=np.int64)], [np.zeros(1, dtype=np.int64)]
+    try:
+        for start in range(0, spec.case_count, chunk_cases):
+            cases = [synthetic_case(rng, case_idx, spec)
+                     for case_idx in range(start, min(start + chunk_cases, spec.case_count))]
+            chunk = _chunk_bundle(cases, spec, rng, text_vectors, mm_vectors)
+            for name in MATRIX_FIELDS:
+                matrix = getattr(chunk, name)
+                append(name, stored_rows(matrix))
+                if isinstance(matrix, QuantizedMatrix) and matrix.scales is not None:
+                    append(f"{name}_scale", matrix.scales)
+                if isinstance(matrix, QuantizedMatrix) and matrix.exact is not None:
+                    append(f"{name}_exact", matrix.exact)
+            for name in ["text_row_item", "text_row_filter", "image_row_item"] + (SKETCH_FIELDS if spec.sketch else []):
+                append(name, getattr(chunk, name))
+            text_offsets.append(chunk.text_offsets[1:] + text_offsets[-1][-1])
+            image_offsets.append(chunk.image_offsets[1:] + image_offsets[-1][-1])
+            cases_meta.extend(chunk.cases_meta)
+            logging.getLogger("benchmarks").info(f"Generated {len(cases_meta)}/{spec.case_count} cases")
+
+        arrays = {name: writer.open() for name, writer in writers.items()}
+        for name in MATRIX_FIELDS:
+            if spec.precision != "float32":
+                arrays[name] = QuantizedMatrix(arrays[name], arrays.pop(f"{name}_scale", None),
+                                               arrays.pop(f"{name}_exact", None))
+        arrays["text_offsets"] = np.concatenate(text_offsets)
+        arrays["image_offsets"] = np.concatenate(image_offsets)
+        bundle = IndexBundle(cases_meta=cases_meta, index_id=str(uuid.uuid4()), **arrays)
+        if spec.ann:
+            bundle.ann = build_ivf(bundle.text_embeddings)
+        bundle_path = save_bundle(bundle, index_folder_path)
+        del bundle, arrays
+    finally:
+        for writer in writers.values():
+            writer.file.close()
+        shutil.rmtree(scratch_path, ignore_errors=True)
+
+    with open(index_folder_path / SPEC_FILE, "w", encoding="utf-8") as f:
+        json.dump(spec.to_dict(), f, indent=2)
+    return bundle_path
+
+
+def synthetic_index(index_folder_path: str, spec: SyntheticSpec) -> bool:
+    """
+    Make sure the folder holds the synthetic index of the spec,
+    return True if it had to be generated
+    """
+    index_folder_path = Path(index_folder_path)
+    spec_path = index_folder_path / SPEC_FILE
+    if bundle_exists(index_folder_path) and spec_path.exists():
+        with open(spec_path, "r", encoding="utf-8") as f:
+            if json.load(f) == spec.to_dict():
+                return False
+    if index_folder_path.exists():
+        shutil.rmtree(index_folder_path)
+    write_synthetic_index(index_folder_path, spec)
+    return True
@@ -38,7 +38,7 @@ function refreshResults(resultData) {
     // Add event handlers after creating the HTML
     setTimeout(function() {
         // Handle click on selected items
-        $('.remove').click(function() {
+        $('.remove').off('click').click(function() {
             var caseId = $(this).data('caseid');
             console.log('remove', caseId);
             $.post('/backend-api/remove_item', {case_id: caseId}, function(resultData) {
@@ -46,11 +46,12 @@ function refreshResults(resultData) {
                 $('#result').html(result);
                 var query_set = refreshQuery(resultData);
                 $('#queryset').html(query_set);
+                $('#more').html(moreButton(resultData));
             });
         });
 
         // Handle click on plus items
-        $('.plus').click(function() {
+        $('.plus').off('click').click(function() {
             var caseId = $(this).data('caseid');
             console.log('add', caseId);
             $.post('/backend-api/add_item', {case_id: caseId}, function(resultData) {
@@ -58,6 +59,7 @@ function refreshResults(resultData) {
                 $('#result').html(result);
                 var query_set = refreshQuery(resultData);
                 $('#queryset').html(query_set);
+                $('#more').html(moreButton(resultData));
             });
         });
     }, 1000);
@@ -65,6 +67,15 @@ function refreshResults(resultData) {
     return result;
 }
 
+// button to load the next page of results, empty when all results are shown
+function moreButton(resultData) {
+    var next = resultData['offset'] + resultData['result'].length;
+    if (next >= resultData['total']) {
+        return '';
+    }
+    return `<button id="moreButton" class="apply-btn" data-offset="${next}">Show More (${next} of ${resultData['total']})</button>`;
+}
+
 function refreshQuery(resultData){
     var query_set = '';
     queries = resultData['query'];
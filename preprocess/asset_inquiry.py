@@ -4,7 +4,9 @@ from retrying import retry
 import json
 import json5
 from utils.app_types import BaseQuestion, AssetItem
-from utils.llm import call_gpt_v, LLMHandler
+from utils.llm import call_gpt_v, LLMHandler, CHAT_MODEL, VISION_MODEL
+from utils.response_cache import get_response_cache
+from utils.providers import get_provider
 
 
 IMAGE_PROMPT = """
@@ -57,8 +59,8 @@ def image_inqury(image_path: str,
                  questions: List[BaseQuestion],
                  ) -> AssetItem:
     
-    # add a question
-    questions.append(BaseQuestion("category", "Category of this image. Choose from: facade, interior, floorplan, section, detail, birdview, other"))
+    # add a question, on a copy so that the caller's list is shared safely between images
+    questions = list(questions) + [BaseQuestion("category", "Category of this image. Choose from: facade, interior, floorplan, section, detail, birdview, other")]
 
     # prepare the prompt
     question_str_list = []
@@ -70,8 +72,26 @@ def image_inqury(image_path: str,
     questionaire = "\n".join(question_str_list)
     prompt = IMAGE_PROMPT.replace("{aspect_list}", questionaire)
 
-    # call the model
+    # call the model, unless the same image was asked the same prompt before
+    cache = get_response_cache()
+    cache_model = get_provider().cache_model(VISION_MODEL)
+    with open(image_path, "rb") as f:
+        image_bytes = f.read()
+    response = cache.get(cache_model, prompt, image_bytes)
+    if response is not None:
+        try:
+            return _image_item(response, image_path, questions)
+        except Exception:
+            # a cached reply of the wrong shape is asked again and replaced
+            pass
     response = call_gpt_v(image_path, prompt)
+    item = _image_item(response, image_path, questions)
+    # only cache responses that give an item, a broken one is asked again on retry
+    cache.put(cache_model, prompt, image_bytes, response)
+    return item
+
+
+def _image_item(response: str, image_path: str, questions: List[BaseQuestion]) -> AssetItem:
     json_text = re.findall(r'```json(.*)```', response, re.DOTALL)[-1]
     json_dict = json.loads(json_text)['analysis']
 
@@ -106,9 +126,25 @@ def text_inquiry(text_path: str,
     prompt = TEXT_PROMPT.replace("{aspect_list}", questionaire)\
         .replace("{content}", text)
 
-    # call the model
+    # call the model, unless the same text was asked the same prompt before
+    cache = get_response_cache()
+    cache_model = get_provider().cache_model(CHAT_MODEL)
+    response = cache.get(cache_model, prompt, text)
+    if response is not None:
+        try:
+            return _text_item(response, text_path, questions)
+        except Exception:
+            # a cached reply of the wrong shape is asked again and replaced
+            pass
     llm_handler = LLMHandler()
     response = llm_handler.chat_with_gpt(prompt)
+    item = _text_item(response, text_path, questions)
+    # only cache responses that give an item, a broken one is asked again on retry
+    cache.put(cache_model, prompt, text, response)
+    return item
+
+
+def _text_item(response: str, text_path: str, questions: List[BaseQuestion]) -> AssetItem:
     json_text = re.findall(r'```json(.*)```', response, re.DOTALL)[-1]
     json_dict = json5.loads(json_text)["analysis"]
 
@@ -119,7 +155,6 @@ def text_inquiry(text_path: str,
     return AssetItem(str(text_path), "text", answers)
 
 
-
 if __name__ == "__main__":
     questions = [BaseQuestion("highlights", "What is the highlight of this design?"),
                  BaseQuestion("shape", "What form does it use? "),
@@ -3,10 +3,29 @@ import logging
 import json
 import pickle
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Optional, Tuple
+from tqdm import tqdm
 
 from preprocess.case_inquiry import case_inquiry
 from preprocess.case_embedding import create_embs
 from utils.app_types import CaseDatabase, DesignCase
+from utils.index_bundle import build_bundle, sketch_bundle, quantize_bundle, save_bundle, bundle_to_database, load_case_pickle, \
+    IndexBundle, bundle_exists, load_bundle, patch_bundle
+from utils.ann_index import build_ivf
+from utils.quantization import PRECISIONS
+from utils.provider_limits import configure_provider_limits, DEFAULT_PROVIDER_LIMITS
+from utils.rate_limit import configure_rate_limits, DEFAULT_RATES
+from utils.http_clients import configure_http_clients, DEFAULT_HTTP_SETTINGS
+from utils.response_cache import configure_response_cache, get_response_cache, content_hash
+from utils.embedding_batcher import configure_embedding_batcher, get_embedding_batcher, MAX_BATCH_TOKENS
+from utils.providers import configure_provider, PROVIDERS
+from utils.image_prep import configure_image_pool
+from utils.image_cache import configure_image_cache, get_image_cache, DEFAULT_IMAGE_CACHE_BYTES
+
+# content hashes of the files a case was built from, next to its pkl
+ASSET_HASHES_SUFFIX = ".assets.json"
+INCREMENTAL_COMMANDS = ["add", "update", "remove"]
 
 def project_folder_iterate(database_folder_path):
     """
@@ -22,64 +41,210 @@ def project_folder_iterate(database_folder_path):
             yield idx, project_folder
 
 
+def asset_hashes(project_folder: Path) -> Dict[str, str]:
+    """
+    Content hash of every input file of the case folder, by file name
+    """
+    files = [project_folder / "description.txt", project_folder / "meta.csv"] + sorted(project_folder.glob("*.jpg"))
+    return {f.name: content_hash(f.read_bytes()) for f in files if f.exists()}
+
+
+def write_asset_hashes(hashes: Dict[str, str], target_folder_path: Path, project_name: str) -> None:
+    with open(target_folder_path / f"{project_name}{ASSET_HASHES_SUFFIX}", "w", encoding="utf-8") as f:
+        json.dump(hashes, f, indent=2)
+
+
+def read_asset_hashes(target_folder_path: Path, project_name: str) -> Dict[str, str]:
+    hashes_path = target_folder_path / f"{project_name}{ASSET_HASHES_SUFFIX}"
+    if not hashes_path.exists():
+        return {}
+    with open(hashes_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def build_case(project_folder: Path,
+               target_folder_path: Path,
+               overwrite=False,
+               ) -> DesignCase:
+    """
+    Build one case, reusing its pkl or json from a previous run if they exist
+    """
+    project_name = project_folder.name
+    case_json_path = target_folder_path / f"{project_name}.json"
+    case_pkl_path = target_folder_path / f"{project_name}.pkl"
+
+    # skip if the case pkl exists
+    if case_pkl_path.exists() and not overwrite:
+        logging.info(f"Read {project_name} pkl")
+        # read the case from pkl
+        return load_case_pickle(case_pkl_path)
+
+    # if the case json exists, skip query and create embeddings
+    if case_json_path.exists() and not overwrite:
+        logging.info(f"Read {project_folder} json")
+        # read the case from json
+        with open(case_json_path, "r", encoding="utf-8") as f:
+            case_dict = json.load(f)
+        case = DesignCase.from_dict(case_dict)
+
+        # create the embeddings
+        case = create_embs(case)
+
+        # save the case to pkl
+        with open(case_pkl_path, "wb") as f:
+            pickle.dump(case, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return case
+
+    # build the case from scratch
+    logging.info(f"Building for {project_folder}")
+    hashes = asset_hashes(project_folder)
+    case_id = str(uuid.uuid4())
+    case = case_inquiry(case_id, project_folder)
+    with open(case_json_path, "w", encoding="utf-8") as f:
+        json.dump(case.to_dict(), f, indent=2)
+    case = create_embs(case)
+
+    with open(case_pkl_path, "wb") as f:
+        pickle.dump(case, f, protocol=pickle.HIGHEST_PROTOCOL)
+    write_asset_hashes(hashes, target_folder_path, project_name)
+    return case
+
+
+def update_case(project_folder: Path,
+                target_folder_path: Path,
+                case_id: str,
+                ) -> Tuple[DesignCase, bool]:
+    """
+    Build the case again, only the assets whose content hash changed since the
+    last build are inquired and embedded. Return the case and whether it changed.
+    """
+    project_name = project_folder.name
+    case_json_path = target_folder_path / f"{project_name}.json"
+    case_pkl_path = target_folder_path / f"{project_name}.pkl"
+    hashes = asset_hashes(project_folder)
+    previous_hashes = read_asset_hashes(target_folder_path, project_name)
+    previous = load_case_pickle(case_pkl_path) if case_pkl_path.exists() else None
+    if previous is not None and hashes == previous_hashes:
+        return previous, False
+
+    # without the previous pkl every asset is inquired again
+    unchanged = {name for name, digest in hashes.items() if previous_hashes.get(name) == digest} \
+        if previous is not None else set()
+    logging.info(f"Updating {project_folder}, {len(hashes) - len(unchanged)} of {len(hashes)} files changed")
+    case = case_inquiry(case_id, project_folder, previous=previous, unchanged=unchanged)
+    with open(case_json_path, "w", encoding="utf-8") as f:
+        json.dump(case.to_dict(), f, indent=2)
+    case = create_embs(case, previous)
+
+    with open(case_pkl_path, "wb") as f:
+        pickle.dump(case, f, protocol=pickle.HIGHEST_PROTOCOL)
+    write_asset_hashes(hashes, target_folder_path, project_name)
+    return case, True
+
+
+def live_case_index(bundle: IndexBundle, case_name: str) -> Optional[int]:
+    """
+    Index of the case named case_name in the bundle, None if it is not in the index
+    """
+    for case_idx, case_dict in enumerate(bundle.cases_meta):
+        if case_dict['name'] == case_name and not bundle.removed[case_idx]:
+            return case_idx
+    return None
+
+
+def patch_database(command: str, project_folder: str, target_folder_path: str) -> IndexBundle:
+    """
+    Add, update or remove one case of a built index without rebuilding the bundle.
+    The change is appended to the bundle log, a running server picks it up on its next poll.
+    """
+    project_folder, target_folder_path = Path(project_folder), Path(target_folder_path)
+    project_name = project_folder.name
+    if not bundle_exists(target_folder_path):
+        raise FileNotFoundError(f"No index bundle in {target_folder_path}, build it first")
+    bundle = load_bundle(target_folder_path)
+    case_idx = live_case_index(bundle, project_name)
+
+    if command == "add":
+        if case_idx is not None:
+            raise ValueError(f"{project_name} is already in the index, use update")
+        case = build_case(project_folder, target_folder_path)
+        bundle = patch_bundle(target_folder_path, "add", add=case)
+    elif command == "update":
+        if case_idx is None:
+            raise ValueError(f"{project_name} is not in the index, use add")
+        case, changed = update_case(project_folder, target_folder_path, bundle.cases_meta[case_idx]['case_id'])
+        if not changed:
+            logging.info(f"{project_name} is up to date")
+            return bundle
+        bundle = patch_bundle(target_folder_path, "update", add=case, remove=[case_idx])
+    elif command == "remove":
+        if case_idx is None:
+            raise ValueError(f"{project_name} is not in the index")
+        bundle = patch_bundle(target_folder_path, "remove", remove=[case_idx])
+        for suffix in [".pkl", ".json", ASSET_HASHES_SUFFIX]:
+            (target_folder_path / f"{project_name}{suffix}").unlink(missing_ok=True)
+    else:
+        raise ValueError(f"Unknown command {command}, choose from {', '.join(INCREMENTAL_COMMANDS)}")
+    logging.info(f"{command} {project_name}: the index has {int((~bundle.removed).sum())} cases")
+    return bundle
+
+
 def build_database(source_folder_path: str, 
                    target_folder_path: str,
-                   overwrite=False
+                   overwrite=False,
+                   ann=False,
+                   ann_lists: int = None,
+                   precision: str = "float32",
+                   keep_exact: bool = False,
+                   sketch: bool = False,
+                   workers: int = 1,
                    )-> CaseDatabase:
+    """
+    Build the cases of all project folders with up to workers cases at a time,
+    the requests to each provider are bounded by the provider limits.
+    A failed case is logged and left out, the next run retries it.
+    """
     # create the target folder if not exists
     target_folder_path = Path(target_folder_path)
     if not target_folder_path.exists():
         target_folder_path.mkdir(parents=True, exist_ok=True)
 
-    cases = []
-    for _, project_folder in project_folder_iterate(source_folder_path):
-        project_name = project_folder.name
-        case_json_path = target_folder_path / f"{project_name}.json"
-        case_pkl_path = target_folder_path / f"{project_name}.pkl"
-
-        # skip if the case pkl exists
-        if case_pkl_path.exists() and not overwrite:
-            logging.info(f"Read {project_name} pkl")
-            # read the case from pkl
-            with open(case_pkl_path, "rb") as f:
-                case = pickle.load(f)
-            # append the case to the list
-            cases.append(case)
-            continue
-
-        # if the case json exists, skip query and create embeddings
-        if case_json_path.exists() and not overwrite:
-            logging.info(f"Read {project_folder} json")
-            # read the case from json
-            with open(case_json_path, "r", encoding="utf-8") as f:
-                case_dict = json.load(f)
-            case = DesignCase.from_dict(case_dict)
-
-            # create the embeddings
-            case = create_embs(case)
-
-            # save the case to pkl
-            with open(case_pkl_path, "wb") as f:
-                pickle.dump(case, f, protocol=pickle.HIGHEST_PROTOCOL)
-
-            # append the case to the list
-            cases.append(case)
-            continue
-
-        # build the case from scratch
-        logging.info(f"Building for {project_folder}")
-        case_id = str(uuid.uuid4())
-        case = case_inquiry(case_id, project_folder)
-        with open(case_json_path, "w", encoding="utf-8") as f:
-            json.dump(case.to_dict(), f, indent=2)
-        case = create_embs(case)
-        
-        with open(case_pkl_path, "wb") as f:
-            pickle.dump(case, f, protocol=pickle.HIGHEST_PROTOCOL)
-        cases.append(case)
+    project_folders = [project_folder for _, project_folder in project_folder_iterate(source_folder_path)]
+    built_cases = {}
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="build-case") as executor:
+        future_to_idx = {
+            executor.submit(build_case, project_folder, target_folder_path, overwrite): idx
+            for idx, project_folder in enumerate(project_folders)
+        }
+        progress = tqdm(as_completed(future_to_idx), total=len(future_to_idx), desc="Building cases")
+        for future in progress:
+            idx = future_to_idx[future]
+            try:
+                built_cases[idx] = future.result()
+            except Exception as e:
+                logging.error(f"Failed to build {project_folders[idx].name}: {e}")
+                failed.append(project_folders[idx].name)
+                progress.set_postfix(failed=len(failed))
+
+    # keep the folder order, whatever order the cases finished in
+    cases = [built_cases[idx] for idx in sorted(built_cases)]
+    if failed:
+        logging.warning(f"{len(failed)} of {len(project_folders)} cases failed: {', '.join(sorted(failed))}")
+
+    # write the consolidated index bundle
+    bundle = build_bundle(cases)
+    if ann and len(bundle.text_embeddings) > 0:
+        bundle.ann = build_ivf(bundle.text_embeddings, ann_lists)
+        logging.info(f"Built ANN index of {bundle.ann.list_count} lists over {len(bundle.text_embeddings)} text rows")
+    if sketch:
+        bundle = sketch_bundle(bundle)
+    bundle = quantize_bundle(bundle, precision, keep_exact)
+    save_bundle(bundle, target_folder_path)
+    logging.info(f"Saved index bundle of {bundle.case_count} cases to {target_folder_path}")
 
     # create the database
-    return CaseDatabase(cases)
+    return bundle_to_database(bundle, cases)
 
 
 if __name__ == "__main__":
@@ -87,9 +252,64 @@ if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser()
+    parser.add_argument("command", type=str, nargs="?", choices=INCREMENTAL_COMMANDS,
+                        help="Add, update or remove the case of case_folder in the built index given by --output")
+    parser.add_argument("case_folder", type=str, nargs="?", help="Case folder of the command")
     parser.add_argument("--data", type=str, default="data/example_dataset")
     parser.add_argument("--output", type=str, default="data/example_index")
     parser.add_argument("--overwrite", type=bool, default=False)
+    parser.add_argument("--ann", action="store_true", help="Build an ANN index over the text embeddings")
+    parser.add_argument("--ann-lists", type=int, default=None, help="Number of ANN lists, about 4 * sqrt(text rows) by default")
+    parser.add_argument("--sketch", action="store_true",
+                        help="Store sign-bit sketches of the embeddings for the Hamming prefilter")
+    parser.add_argument("--precision", type=str, default="float32", choices=PRECISIONS,
+                        help="Storage precision of the embedding matrices")
+    parser.add_argument("--exact", action="store_true",
+                        help="Also keep float32 copies of quantized matrices for the exact rerank")
+    parser.add_argument("--workers", type=int, default=1, help="Number of cases built at the same time")
+    parser.add_argument("--openai-limit", type=int, default=DEFAULT_PROVIDER_LIMITS["openai"],
+                        help="Maximum number of OpenAI requests in flight")
+    parser.add_argument("--replicate-limit", type=int, default=DEFAULT_PROVIDER_LIMITS["replicate"],
+                        help="Maximum number of Replicate requests in flight")
+    parser.add_argument("--replicate-rate", type=float, default=DEFAULT_RATES["replicate"],
+                        help="Replicate requests per second, lowered automatically while throttled")
+    parser.add_argument("--http-pool-size", type=int, default=DEFAULT_HTTP_SETTINGS["pool_size"],
+                        help="Kept-alive connections per API client")
+    parser.add_argument("--http-timeout", type=float, default=DEFAULT_HTTP_SETTINGS["timeout"],
+                        help="Seconds to wait for an API response")
+    parser.add_argument("--response-cache", type=str, default="cache/responses",
+                        help="Folder of the cache of GPT responses, an empty string disables it")
+    parser.add_argument("--embedding-batch-tokens", type=int, default=MAX_BATCH_TOKENS,
+                        help="Estimated token budget of one OpenAI embedding request")
+    parser.add_argument("--embedding-requests", type=int, default=4,
+                        help="Number of OpenAI embedding requests in flight")
+    parser.add_argument("--image-workers", type=int, default=None,
+                        help="Processes preparing the images for the embedding requests, one per core by default")
+    parser.add_argument("--image-cache", type=str, default="cache/images",
+                        help="Folder of the cache of prepared images, an empty string disables it")
+    parser.add_argument("--image-cache-mb", type=int, default=DEFAULT_IMAGE_CACHE_BYTES // 2 ** 20,
+                        help="Size of the image cache, the least recently used images are evicted above it")
+    parser.add_argument("--provider", type=str, default="openai", choices=list(PROVIDERS),
+                        help="Model provider, local answers offline with hash vectors and templated inquiries")
+    parser.add_argument("--provider-latency", type=float, default=0.0,
+                        help="Seconds the local provider waits on every call")
     args = parser.parse_args()
 
-    build_database(args.data, args.output, args.overwrite)
+    configure_provider(args.provider, **({"latency": args.provider_latency} if args.provider == "local" else {}))
+    configure_provider_limits({"openai": args.openai_limit, "replicate": args.replicate_limit})
+    configure_rate_limits({"replicate": args.replicate_rate})
+    configure_http_clients({"pool_size": args.http_pool_size, "timeout": args.http_timeout})
+    configure_response_cache(args.response_cache or None)
+    configure_embedding_batcher(args.embedding_batch_tokens, max_in_flight=args.embedding_requests)
+    configure_image_pool(args.image_workers)
+    configure_image_cache(args.image_cache or None, args.image_cache_mb * 2 ** 20)
+    if args.command:
+        if not args.case_folder:
+            parser.error(f"{args.command} needs a case folder")
+        patch_database(args.command, args.case_folder, args.output)
+    else:
+        build_database(args.data, args.output, args.overwrite, args.ann, args.ann_lists, args.precision, args.exact, args.sketch,
+                       args.workers)
+    logging.info(f"Response cache: {get_response_cache().stats()}")
+    logging.info(f"Embedding requests: {get_embedding_batcher().request_count}")
+    logging.info(f"Image cache: {get_image_cache().stats()}")
@@ -1,38 +1,52 @@
-from utils.app_types import DesignCase
-from utils.llm import LLMHandler
+from utils.app_types import DesignCase, AssetItem
+from utils.embedding_batcher import get_embedding_batcher
 from utils.replicate_api import batch_text_embeddings, batch_image_embeddings
 import numpy as np
 
-def create_embs(case: DesignCase) -> DesignCase:
+def create_embs(case: DesignCase, previous: DesignCase = None) -> DesignCase:
     """
     Create embeddings for each asset in the case.
+    With the previous build of the case, its texts and the asset items
+    reused from it keep their embeddings, only the rest is embedded.
     """
     texts = case.get_all_text()
-    # get the indices where the text is not empty or ""
-    non_empty_indices = [i for i, text in enumerate(texts) if text != ""]
+    embs, embs_multi = [None] * len(texts), [None] * len(texts)
+    reused_items = set()
+    if previous is not None:
+        known = {text: (emb, emb_multi) for text, emb, emb_multi
+                 in zip(previous.get_all_text(), previous.embeddings, previous.multi_modal_embeddings)}
+        for i, text in enumerate(texts):
+            if text != "" and text in known:
+                embs[i], embs_multi[i] = known[text]
+        reused_items = {id(item) for item in previous.content}
+
+    # get the indices where the text is not empty or "" and has no embedding yet
+    non_empty_indices = [i for i, text in enumerate(texts) if text != "" and embs[i] is None]
     # get the non empty texts
     non_empty_texts = [texts[i] for i in non_empty_indices]
 
-    # get the embeddings
-    emb_handler = LLMHandler()
-    non_empty_embs = emb_handler.get_text_embeddings_multi(non_empty_texts)
-    # create a list of empty embeddings
-    embs = [np.zeros(len(non_empty_embs[0])) for _ in texts]
-    # fill the embeddings with the non empty embeddings
-    for i, emb in zip(non_empty_indices, non_empty_embs):
-        embs[i] = emb
-    case.embeddings = np.array(embs)
+    if non_empty_texts:
+        # get the embeddings, packed with the texts of other cases into token-bounded requests
+        non_empty_embs = get_embedding_batcher().embed(non_empty_texts)
+        for i, emb in zip(non_empty_indices, non_empty_embs):
+            embs[i] = emb
+
+        # get multimodal embeddings
+        non_empty_embs_multi = batch_text_embeddings(non_empty_texts, max_workers=6)
+        for i, emb in zip(non_empty_indices, non_empty_embs_multi):
+            embs_multi[i] = emb
 
-    # get multimodal embeddings
-    non_empty_embs_multi = batch_text_embeddings(non_empty_texts, max_workers=6)
-    embs_multi = [np.zeros(len(non_empty_embs_multi[-1])) for _ in texts]
-    for i, emb in zip(non_empty_indices, non_empty_embs_multi):
-        embs_multi[i] = emb
-    case.multi_modal_embeddings = np.array(embs_multi)
+    # empty texts get zero embeddings
+    dim = len(next(emb for emb in embs if emb is not None))
+    dim_multi = len(next(emb for emb in embs_multi if emb is not None))
+    case.embeddings = np.array([np.zeros(dim) if emb is None else emb for emb in embs])
+    case.multi_modal_embeddings = np.array([np.zeros(dim_multi) if emb is None else emb for emb in embs_multi])
 
-    # get the image embeddings
-    image_paths = case.get_all_image_paths()
-    image_embs = batch_image_embeddings(image_paths, max_workers=8)
-    case.set_all_image_embeddings(image_embs)
+    # get the image embeddings of the items that were not reused
+    image_items = [item for item in case.content if isinstance(item, AssetItem) and id(item) not in reused_items]
+    if image_items:
+        image_embs = batch_image_embeddings([item.asset_path for item in image_items], max_workers=8)
+        for item, emb in zip(image_items, image_embs):
+            item.multi_modal_embedding = emb
 
     return case
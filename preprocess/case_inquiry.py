@@ -1,6 +1,8 @@
 import os
-from pathlib import Path
-from utils.app_types import DesignCase, BaseQuestion, TopicCategory
+from pathlib import Path, PureWindowsPath
+from concurrent.futures import ThreadPoolExecutor
+from typing import Collection
+from utils.app_types import DesignCase, BaseQuestion, TopicCategory, RawTextItem
 from preprocess.asset_inquiry import image_inqury, text_inquiry
 from preprocess.asset_text_process import split_text
 
@@ -8,9 +10,23 @@ from preprocess.asset_text_process import split_text
 text_questions = [BaseQuestion(question) for question in list(TopicCategory.__args__)]
 image_questions = [BaseQuestion(question) for question in list(TopicCategory.__args__)]
 
+def asset_file_name(asset_path) -> str:
+    # pickles written on Windows hold Windows paths, their name is read the same way
+    return PureWindowsPath(str(asset_path)).name
+
+
 def case_inquiry(case_id,
                  case_folder_path:str,
+                 max_workers: int = None,
+                 previous: DesignCase = None,
+                 unchanged: Collection[str] = (),
                  ) -> DesignCase:
+    """
+    Inquire the text and all images of the case concurrently, one request per asset
+    (bounded by the provider limits). The assets keep a fixed order:
+    text chunks, text answers, then the images sorted by file name.
+    The assets of previous whose file name is in unchanged are reused without a request.
+    """
     
     # get case name from the folder name
     case_name = Path(case_folder_path).name
@@ -32,21 +48,41 @@ def case_inquiry(case_id,
     if not os.path.exists(text_path):
         raise FileNotFoundError(f"{text_path} does not exist.")
     
+    # assets of the previous build whose file did not change
+    reused_text, reused_answers, reused_images = None, None, {}
+    for item in (previous.content if previous is not None else []):
+        name = asset_file_name(item.asset_path)
+        if name not in unchanged:
+            continue
+        if isinstance(item, RawTextItem):
+            reused_text = item
+        elif item.category == "text":
+            reused_answers = item
+        else:
+            reused_images[name] = item
+
     # chunk and add the text asset
-    text_result = split_text(text_path)
+    text_result = reused_text or split_text(text_path)
     assets.append(text_result)
 
-    # call the text inquiry
-    text_result = text_inquiry(text_path, text_questions)
-    assets.append(text_result)
+    # all jpg files in the folder, sorted so that the order does not depend on the file system
+    image_paths = sorted(Path(case_folder_path).glob("*.jpg"))
+
+    def inquire_image(image_path):
+        if image_path.name in reused_images:
+            return reused_images[image_path.name]
+        # each call copies the questions before extending them
+        return image_inqury(image_path, image_questions)
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(image_paths) + 1) as executor:
+        # call the text inquiry
+        text_future = None if reused_answers else executor.submit(text_inquiry, text_path, text_questions)
 
-    # iterate all jpg files in the folder
-    for image_path in Path(case_folder_path).glob("*.jpg"):
-        questions = image_questions
+        # call the image inquiries
+        image_results = executor.map(inquire_image, image_paths)
 
-        # call the image inquiry
-        image_result = image_inqury(image_path, questions)
-        assets.append(image_result)
+        assets.append(reused_answers or text_future.result())
+        assets.extend(image_results)
 
     return DesignCase(case_id, case_name, str(case_folder_path), 
                       web_url, assets)
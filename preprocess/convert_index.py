@@ -0,0 +1,76 @@
+from pathlib import Path
+import logging
+import json
+
+from preprocess.case_embedding import create_embs
+from preprocess.build import ASSET_HASHES_SUFFIX
+from utils.app_types import DesignCase
+from utils.index_bundle import build_bundle, sketch_bundle, quantize_bundle, save_bundle, load_case_pickle
+from utils.ann_index import build_ivf
+from utils.quantization import PRECISIONS
+
+
+def convert_index(index_folder_path: str,
+                  ann: bool = False,
+                  ann_lists: int = None,
+                  precision: str = "float32",
+                  keep_exact: bool = False,
+                  sketch: bool = False,
+                  ) -> Path:
+    """
+    Convert an index of per-case pkl/json files into the consolidated bundle.
+    A case with a readable pkl reuses its embeddings,
+    a case with only a json file is embedded again.
+    """
+    index_folder_path = Path(index_folder_path)
+    case_names = sorted({p.stem for p in index_folder_path.glob("*.pkl")} |
+                        {p.stem for p in index_folder_path.glob("*.json") if not p.name.endswith(ASSET_HASHES_SUFFIX)})
+
+    cases = []
+    for case_name in case_names:
+        case_pkl_path = index_folder_path / f"{case_name}.pkl"
+        case_json_path = index_folder_path / f"{case_name}.json"
+        case = None
+        if case_pkl_path.exists():
+            try:
+                case = load_case_pickle(case_pkl_path)
+            except Exception as e:
+                logging.error(f"Error loading {case_pkl_path}: {e}")
+        if case is None and case_json_path.exists():
+            logging.info(f"Embedding {case_name} from json")
+            with open(case_json_path, "r", encoding="utf-8") as f:
+                case = DesignCase.from_dict(json.load(f))
+            case = create_embs(case)
+        if case is None:
+            logging.error(f"Skip {case_name}, no readable pkl or json")
+            continue
+        cases.append(case)
+
+    bundle = build_bundle(cases)
+    if ann and len(bundle.text_embeddings) > 0:
+        bundle.ann = build_ivf(bundle.text_embeddings, ann_lists)
+    if sketch:
+        bundle = sketch_bundle(bundle)
+    bundle = quantize_bundle(bundle, precision, keep_exact)
+    bundle_path = save_bundle(bundle, index_folder_path)
+    logging.info(f"Converted {bundle.case_count} cases into {bundle_path}")
+    return bundle_path
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index", type=str, default="data/example_index")
+    parser.add_argument("--ann", action="store_true", help="Build an ANN index over the text embeddings")
+    parser.add_argument("--ann-lists", type=int, default=None, help="Number of ANN lists, about 4 * sqrt(text rows) by default")
+    parser.add_argument("--sketch", action="store_true",
+                        help="Store sign-bit sketches of the embeddings for the Hamming prefilter")
+    parser.add_argument("--precision", type=str, default="float32", choices=PRECISIONS,
+                        help="Storage precision of the embedding matrices")
+    parser.add_argument("--exact", action="store_true",
+                        help="Also keep float32 copies of quantized matrices for the exact rerank")
+    args = parser.parse_args()
+
+    convert_index(args.index, args.ann, args.ann_lists, args.precision, args.exact, args.sketch)
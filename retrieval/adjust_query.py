@@ -1,16 +1,47 @@
-from utils.app_types import QuerySet, EnrichedQuery, default_filter_weights
-from typing import Dict
+from utils.app_types import QuerySet, EnrichedQuery, CaseDatabase, default_filter_weights
+from utils.quantization import exact_rows
+from typing import Dict, Union
 import numpy as np
 
 
-def add_item_to_query_set(query_set: QuerySet, entry_dict: Dict, add_id: str) -> QuerySet:
+def attach_index_embeddings(query: EnrichedQuery, database: CaseDatabase, entry: Dict) -> EnrichedQuery:
+    """
+    Copy the stored index embeddings of a liked entry into the query,
+    so that it does not need to be embedded again.
+    Rows are only trusted if they come from the same index build.
+    """
+    index = database.index
+    if index is None or entry.get('index_id') != index.index_id:
+        return query
+    text_row, image_row = entry.get('text_row'), entry.get('image_row')
+
+    if text_row is not None:
+        query.txt_embedding = exact_rows(index.text_embeddings, text_row)
+
+    # prefer the liked image, otherwise the ImageBind embedding of the liked text
+    if image_row is not None:
+        query.txt_multi_modal_embedding = np.array(exact_rows(index.image_embeddings, image_row), dtype=float)
+    elif text_row is not None:
+        multi_modal_embedding = np.array(exact_rows(index.text_mm_embeddings, text_row), dtype=float)
+        norm = np.linalg.norm(multi_modal_embedding)
+        if norm > 0:
+            query.txt_multi_modal_embedding = multi_modal_embedding / norm
+    return query
+
+
+def add_item_to_query_set(query_set: QuerySet, entry_dict: Dict, add_id: str,
+                          database: CaseDatabase = None) -> QuerySet:
     """
     Add an item to the query set
     """
     query_set.selected_ids.append(add_id)
-    max_entry = entry_dict[str(add_id)]
-    query_set.queries.append(EnrichedQuery(max_entry, 
-                                           related_id=add_id, weights=default_filter_weights))
+    entry: Union[Dict, str] = entry_dict[str(add_id)]
+    if isinstance(entry, str):
+        entry = {'max_entry': entry}
+    query = EnrichedQuery(entry['max_entry'], related_id=add_id, weights=default_filter_weights)
+    if database is not None:
+        query = attach_index_embeddings(query, database, entry)
+    query_set.queries.append(query)
     query_set.weights.append(0.5)
     query_set.weights = list(np.array(query_set.weights) / np.sum(query_set.weights))
     return query_set
@@ -20,9 +51,9 @@ def remove_item_from_query_set(query_set: QuerySet, remove_id: int) -> QuerySet:
     Remove an item from the query set
     """
     query_set.selected_ids.remove(remove_id)
-    for query in query_set.queries:
-        if query.related_id == remove_id:
-            query_set.queries.remove(query)
+    keep = [idx for idx, query in enumerate(query_set.queries) if query.related_id != remove_id]
+    query_set.queries = [query_set.queries[idx] for idx in keep]
+    query_set.weights = [query_set.weights[idx] for idx in keep]
 
     # normalize the weights
     query_set.weights = list(np.array(query_set.weights) / np.sum(query_set.weights))
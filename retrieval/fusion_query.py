@@ -1,90 +1,238 @@
-from retrieval.text_query import text_based_query
-from retrieval.multi_modal_query import multi_modal_query
+from retrieval.text_query import text_based_query, text_case_scores, text_result
+from retrieval.multi_modal_query import multi_modal_query, image_case_scores, image_result
+from retrieval.rank_fusion import RankedList, fuse, fuse_ranked_lists
 from utils.app_types import CaseDatabase, QuerySet, RetrievalResult, EnrichedQuery, DesignCase, AssetItem, ItemFilter, BaseQuestion
-from typing import List, Literal, OrderedDict
+from typing import List, Literal, OrderedDict, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 import numpy as np
 from copy import deepcopy
-from utils.replicate_api import batch_text_embeddings
-from utils.llm import LLMHandler
+from utils.replicate_api import batch_text_embeddings, IMAGEBIND_MODEL
+from utils.llm import LLMHandler, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS
+from utils.embedding_cache import get_embedding_cache
+from utils.providers import get_provider
 
 
 SearchMode = Literal["text", "image", "fusion", "random"]
 
 
+def _embed_texts(texts: List[str]) -> Dict[str, List[float]]:
+    if not texts:
+        return {}
+    return dict(zip(texts, LLMHandler().get_text_embeddings_multi(texts)))
+
+
+def _embed_multi_modal_texts(texts: List[str]) -> Dict[str, List[float]]:
+    if not texts:
+        return {}
+    return dict(zip(texts, batch_text_embeddings(texts, max_workers=len(texts))))
+
+
 def embed_query_set(query_set: QuerySet) -> QuerySet:
     """
-    Embed the query set if it contains text content but no embedding
-    If the query contains image embedding, do nothing
+    Embed the queries that have text content but miss an embedding,
+    queries restored from the session state keep their embeddings
+    Embeddings of repeated texts come from the embedding cache,
+    the remaining texts go out as one batched OpenAI request and concurrent
+    ImageBind requests, with both providers running in parallel
     """
+    cache = get_embedding_cache()
+    provider = get_provider()
+    txt_model, multi_modal_model = provider.cache_model(EMBEDDING_MODEL), provider.cache_model(IMAGEBIND_MODEL)
+    txt_embeddings, multi_modal_embeddings = {}, {}
     for query in query_set.queries:
-        if not query.txt_embedding and query.content:
-            query.txt_multi_modal_embedding = np.array(batch_text_embeddings([query.content])[0])
+        if not query.content:
+            continue
+        if len(query.txt_embedding) == 0 and query.content not in txt_embeddings:
+            txt_embeddings[query.content] = cache.get(txt_model, EMBEDDING_DIMENSIONS, query.content)
+        if len(query.txt_multi_modal_embedding) == 0 and query.content not in multi_modal_embeddings:
+            multi_modal_embeddings[query.content] = cache.get(multi_modal_model, None, query.content)
+
+    # embed the cache misses
+    txt_missing = [text for text, emb in txt_embeddings.items() if emb is None]
+    multi_modal_missing = [text for text, emb in multi_modal_embeddings.items() if emb is None]
+    if txt_missing and multi_modal_missing:
+        # the ImageBind requests run next to the OpenAI request made in the calling thread,
+        # the requests in flight per provider are bounded by the provider slots
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-embedding") as executor:
+            multi_modal_future = executor.submit(_embed_multi_modal_texts, multi_modal_missing)
+            txt_new = _embed_texts(txt_missing)
+            multi_modal_new = multi_modal_future.result()
+    else:
+        txt_new, multi_modal_new = _embed_texts(txt_missing), _embed_multi_modal_texts(multi_modal_missing)
+    for text, emb in txt_new.items():
+        txt_embeddings[text] = emb
+        cache.put(txt_model, EMBEDDING_DIMENSIONS, text, emb)
+    for text, emb in multi_modal_new.items():
+        multi_modal_embeddings[text] = emb
+        if emb is not None:
+            cache.put(multi_modal_model, None, text, emb)
+
+    for query in query_set.queries:
+        if not query.content:
+            continue
+        if len(query.txt_multi_modal_embedding) == 0:
+            query.txt_multi_modal_embedding = np.array(multi_modal_embeddings[query.content], dtype=float)
             query.txt_multi_modal_embedding = query.txt_multi_modal_embedding / np.linalg.norm(query.txt_multi_modal_embedding)
-            query.txt_embedding = LLMHandler().get_text_embeddings(query.content)
+        if len(query.txt_embedding) == 0:
+            query.txt_embedding = list(txt_embeddings[query.content])
     return query_set
 
 
-def randomize_result(design_case: DesignCase) -> RetrievalResult:
+def randomize_result(design_case: DesignCase, rng: np.random.Generator = None) -> RetrievalResult:
     """
-    Randomize the result for the design case
+    Randomize the result for the design case, drawn from rng if given
     """
+    rng = rng if rng is not None else np.random.default_rng()
     case_id = design_case.case_id
     case_name = design_case.name
     score = 0
     web_link = design_case.web_link
     # ramdomly choose an AssetItem from case.content
     while True:
-        max_item = np.random.choice(design_case.content)
+        max_item = design_case.content[rng.integers(len(design_case.content))]
         if isinstance(max_item, AssetItem) and max_item.category != "text":
             answers: OrderedDict = max_item.answers
             while True:
                 # randomly choose a topic from the answers
-                question: BaseQuestion = np.random.choice(list(answers.keys()))
+                questions = list(answers.keys())
+                question: BaseQuestion = questions[rng.integers(len(questions))]
                 max_filter: ItemFilter = (max_item.category, question.theme)
                 answers_list = answers[question]
                 if len(answers_list) > 0:
-                    max_entry = np.random.choice(answers_list)
+                    max_entry = answers_list[rng.integers(len(answers_list))]
                     return RetrievalResult(case_id, case_name, score, web_link, max_entry, max_item, max_filter)
 
 
+@dataclass
+class QueryRanking:
+    """
+    Ranking of the cases for one query, with the best rows of each arm
+    """
+    ranked: RankedList
+    text: RankedList = None
+    image: RankedList = None
+    text_rows: np.ndarray = None   # (case_count, ) best text row of each case
+    image_rows: np.ndarray = None  # (case_count, ) best image row of each case, -1 without images
+    text_ranks: np.ndarray = None  # (case_count, ) rank of each case on the text arm
+    image_ranks: np.ndarray = None # (case_count, ) rank of each case on the image arm, -1 without images
+
+    def has_case(self, case_idx: int) -> bool:
+        """
+        Whether an arm found a row of the case, an approximate text search may miss cases
+        """
+        return (self.text_rows is not None and self.text_rows[case_idx] >= 0) or \
+            (self.image_rows is not None and self.image_rows[case_idx] >= 0)
+
+
+def rank_query(database: CaseDatabase,
+               query: EnrichedQuery,
+               mode: SearchMode = "fusion",
+               text_only: bool = False,
+               rrf_k: float = 10,
+               top: int = None,
+               nprobe: int = None,
+               rerank: int = None,
+               shortlist: int = None,
+               **kwargs
+               ) -> QueryRanking:
+    """
+    Rank the cases for one query on the text arm, the image arm or their RRF fusion.
+    If top is given, a single arm only ranks its best top cases,
+    the fusion of two arms always needs the full ranks.
+    nprobe enables the approximate text search if the index has an ANN index,
+    rerank scores the best cases of each arm again on the float32 rows of a quantized index,
+    shortlist restricts each arm to the rows closest in Hamming distance if the index has sign sketches.
+    """
+    ranking = QueryRanking(ranked=None)
+    ranked_lists = []
+    arm_top = top if mode != "fusion" else None
+    if mode in ("text", "fusion"):
+        text_scores, ranking.text_rows = text_case_scores(database, query, text_only, nprobe, rerank, shortlist)
+        ranking.text = RankedList.from_case_scores(text_scores, top=arm_top)
+        ranking.text_ranks = ranking.text.ranks(database.case_count)
+        ranked_lists.append(ranking.text)
+    if mode in ("image", "fusion"):
+        image_scores, ranking.image_rows = image_case_scores(database, query, rerank, shortlist)
+        ranking.image = RankedList.from_case_scores(image_scores, top=arm_top)
+        ranking.image_ranks = ranking.image.ranks(database.case_count)
+        ranked_lists.append(ranking.image)
+    if mode == "fusion":
+        ranking.ranked = fuse_ranked_lists(ranked_lists, database.case_count, "rrf", rrf_k)
+    elif ranked_lists:
+        ranking.ranked = ranked_lists[0]
+    else:
+        raise ValueError(f"Unknown search mode {mode}")
+    return ranking
+
+
+def ranking_result(database: CaseDatabase,
+                   ranking: QueryRanking,
+                   case_idx: int,
+                   score: float,
+                   ) -> RetrievalResult:
+    """
+    Build the retrieval result of a case, the entry comes from the text arm,
+    the item from the arm where the case ranks higher
+    """
+    if ranking.text is None or ranking.text_rows[case_idx] < 0:
+        return image_result(database, case_idx, ranking.image_rows[case_idx], score)
+    result = text_result(database, case_idx, ranking.text_rows[case_idx], score)
+    if ranking.image is not None and ranking.image_rows[case_idx] >= 0:
+        if not ranking.text_ranks[case_idx] < ranking.image_ranks[case_idx]:
+            img_item = image_result(database, case_idx, ranking.image_rows[case_idx], score)
+            result.max_item = img_item.max_item
+            result.max_filter = img_item.max_filter
+            result.image_row = img_item.image_row
+    return result
+
+
 def fusion_query(database: CaseDatabase, 
                 input_query_set: QuerySet,
                 mode: SearchMode = "text",
                 query_k: float = 10,
+                k: int = None,
+                offset: int = 0,
                 **kwargs
-                ) -> List[RetrievalResult]:
+                ) -> Tuple[List[RetrievalResult], int]:
+    """
+    Query the database, return the page of k results starting at offset
+    (all results if k is None) and the total number of results.
+    Only the results of the page are built.
+    """
+    top = None if k is None else offset + k
     if mode == "random" or len(input_query_set.queries) == 0:
-        result_list = [randomize_result(case) for _, case in database.cases.items()]
-        np.random.shuffle(result_list)
-        return result_list
+        case_list = database.case_list()
+        live = database.live_case_indices()
+        # with the seed of the query set every page slices the same order and shows the same entries
+        seed = input_query_set.seed
+        order = live[np.random.default_rng(seed).permutation(len(live))[offset:top]]
+        result_list = [randomize_result(case_list[case_idx],
+                                        np.random.default_rng(None if seed is None else [seed, int(case_idx)]))
+                       for case_idx in order]
+        return result_list, len(live)
     else:
         query_set = deepcopy(input_query_set)
         query_set = embed_query_set(query_set)
-        result_list = [text_img_fusion_query(database, query, mode, **kwargs) for query in query_set.queries]
-
-        # calculate weighted rank score
-        rank_scores = {}
-        for query_idx, result in enumerate(result_list):
-            for rank, item in enumerate(result):
-                if item.case_id not in rank_scores:
-                    rank_scores[item.case_id] = 0
-                rank_scores[item.case_id] += 1 / (rank + query_k) * query_set.weights[query_idx]
-
-        # sort the scores
-        sorted_scores = sorted(rank_scores.items(), key=lambda x: x[1], reverse=True)
-
-        final_result = []
-        for case_id, score in sorted_scores:
-            case = next(case for _, case in database.cases.items() if case.case_id == case_id)
-            max_entry = next(item.max_entry for item in result_list[0] if item.case_id == case_id)
-            max_item = next(item.max_item for item in result_list[0] if item.case_id == case_id)
-            max_filter = next(item.max_filter for item in result_list[0] if item.case_id == case_id)
-
-            final_result.append(RetrievalResult(
-                case_id, case.name, score, case.web_link, max_entry, max_item, max_filter
-            ))
-
-        return final_result
+
+        # with a single query its ranking is the final ranking, so it only needs the top
+        query_top = top if len(query_set.queries) == 1 else None
+        rankings = [rank_query(database, query, mode, top=query_top, **kwargs) for query in query_set.queries]
+
+        # fuse the weighted rankings of all queries
+        ranked_lists = [RankedList(ranking.ranked.case_indices, ranking.ranked.scores, query_set.weights[query_idx],
+                                   ranking.ranked.candidate_count)
+                        for query_idx, ranking in enumerate(rankings)]
+        fused_scores, order = fuse(ranked_lists, database.case_count, "rrf", query_k, top)
+        if len(ranked_lists) == 1:
+            total = ranked_lists[0].candidate_count
+        else:
+            total = int(np.count_nonzero(np.isfinite(fused_scores)))
+
+        # the displayed entry of each case comes from the first query that found it
+        return [ranking_result(database, next(r for r in rankings if r.has_case(case_idx)),
+                               case_idx, fused_scores[case_idx])
+                for case_idx in order[offset:]], total
  
 
 def text_img_fusion_query(
@@ -94,15 +242,13 @@ def text_img_fusion_query(
         **kwargs
         ) -> List[RetrievalResult]:
     if mode == "text":
-        text_result = text_based_query(database, query, **kwargs)
-        return text_result
+        return text_based_query(database, query, **kwargs)
     elif mode == "image":
-        img_result = multi_modal_query(database, query, **kwargs)
-        return img_result
+        return multi_modal_query(database, query, **kwargs)
     elif mode == "fusion":
-        text_result = text_based_query(database, query, **kwargs)
-        img_result = multi_modal_query(database, query, **kwargs)
-        return rrf_fusion(database, text_result, img_result)
+        ranking = rank_query(database, query, mode, **kwargs)
+        return [ranking_result(database, ranking, case_idx, score)
+                for case_idx, score in zip(ranking.ranked.case_indices, ranking.ranked.scores)]
 
 
 def rrf_fusion(database: CaseDatabase, 
@@ -110,36 +256,32 @@ def rrf_fusion(database: CaseDatabase,
                img_result: List[RetrievalResult],
                k: float = 10
                ) -> List[RetrievalResult]:
-    # use RRF to fuse the results
-    rank_in_text = {item.case_id: rank for rank, item in enumerate(text_result)}
-    rank_in_img = {item.case_id: rank for rank, item in enumerate(img_result)}
-    score_in_text = {item.case_id: item.score for item in text_result}
-    score_in_img = {item.case_id: item.score for item in img_result}
-
-    scores = {}
-    for result in [text_result, img_result]:
-        for rank, item in enumerate(result):
-            if item.case_id not in scores:
-                scores[item.case_id] = 0
-            scores[item.case_id] += 1 / (rank + k)
-            
-    # sort the scores
-    sorted_scores = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-    final_result = []
-    for case_id, score in sorted_scores:
-        case = next(case for _, case in database.cases.items() if case.case_id == case_id)
-        max_entry_in_text = next(item.max_entry for item in text_result if item.case_id == case_id)
-
-        if case_id not in rank_in_img or rank_in_text[case_id] < rank_in_img[case_id]:
-            max_item = next(item.max_item for item in text_result if item.case_id == case_id)
-            max_filter = next(item.max_filter for item in text_result if item.case_id == case_id)
-        else:
-            max_item = next(item.max_item for item in img_result if item.case_id == case_id)
-            max_filter = next(item.max_filter for item in img_result if item.case_id == case_id)
+    """
+    Fuse two result lists with RRF
+    """
+    case_list = database.case_list()
+    case_position = {case_list[case_idx].case_id: case_idx for case_idx in database.live_case_indices()}
+    text_by_case = {case_position[item.case_id]: item for item in text_result}
+    img_by_case = {case_position[item.case_id]: item for item in img_result}
+    ranked_lists = [RankedList(np.array(list(by_case), dtype=np.int64),
+                               np.array([item.score for item in by_case.values()]))
+                    for by_case in (text_by_case, img_by_case)]
+    text_ranks = ranked_lists[0].ranks(database.case_count)
+    img_ranks = ranked_lists[1].ranks(database.case_count)
+    fused_scores, order = fuse(ranked_lists, database.case_count, "rrf", k)
 
+    final_result = []
+    for case_idx in order:
+        # with candidate searches (ANN, sketch shortlist) a case can be missing from either list
+        text_item = text_by_case.get(case_idx)
+        img_item = img_by_case.get(case_idx)
+        item = text_item if img_item is None or (text_item is not None and text_ranks[case_idx] < img_ranks[case_idx]) \
+            else img_item
+        entry_item = text_item if text_item is not None else img_item
         final_result.append(RetrievalResult(
-            case_id, case.name, score, case.web_link, max_entry_in_text, max_item, max_filter,
-            raw_scores=[score_in_text.get(case_id, 0), score_in_img.get(case_id, 0)]
+            entry_item.case_id, entry_item.name, fused_scores[case_idx], entry_item.url,
+            entry_item.max_entry, item.max_item, item.max_filter,
+            raw_scores=[text_item.score if text_item is not None else 0, img_item.score if img_item is not None else 0],
+            text_row=entry_item.text_row, image_row=item.image_row,
         ))
     return final_result
-
@@ -1,39 +1,66 @@
-from utils.app_types import CaseDatabase, RetrievalResult, EnrichedQuery
-from typing import List
+from utils.app_types import CaseDatabase, RetrievalResult, EnrichedQuery, DesignCase
+from retrieval.scoring import segment_argmax, candidate_case_scores, ranked_cases, rerank_cases, drop_removed
+from utils.quantization import exact_rows, has_exact_copy
+from utils.sketch import hamming_shortlist
+from typing import List, Tuple
 import numpy as np
 
 
+def image_case_scores(
+        database: CaseDatabase,
+        query: EnrichedQuery,
+        rerank: int = None,
+        shortlist: int = None,
+        ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Score every image row with one matrix-vector product over the
+    pre-normalized image matrix, return the max score of each case and the row reaching it.
+    If shortlist is given and the index has sign sketches, only the shortlist rows
+    closest in Hamming distance are scored, cases without a candidate get -inf and -1.
+    If rerank is given and the index is quantized with an exact copy,
+    the best rerank cases are scored again on the float32 rows.
+    """
+    index = database.index
+    np_query_embs = np.asarray(query.txt_multi_modal_embedding, dtype=np.float32)  # shape: (emb_dim, )
+    if shortlist and index.image_sketch is not None and shortlist < len(index.image_sketch):
+        rows = hamming_shortlist(index.image_sketch, np_query_embs, shortlist)
+        dot_product = index.image_embeddings[rows] @ np_query_embs  # shape: (shortlist, )
+        case_scores, max_rows = candidate_case_scores(dot_product, rows, index.image_offsets)
+    else:
+        dot_product = index.image_embeddings @ np_query_embs  # shape: (image_rows, )
+        case_scores, max_rows = segment_argmax(dot_product, index.image_offsets)
+    case_scores, max_rows = drop_removed(case_scores, max_rows, index.removed)
+    if rerank and has_exact_copy(index.image_embeddings):
+        case_scores, max_rows = rerank_cases(
+            case_scores, max_rows, index.image_offsets,
+            lambda rows: exact_rows(index.image_embeddings, rows) @ np_query_embs,
+            rerank)
+    return case_scores, max_rows
+
+
+def image_result(database: CaseDatabase, case_idx: int, row: int, score: float) -> RetrievalResult:
+    """
+    Build the retrieval result of a case from its best image row
+    """
+    case_item: DesignCase = database.case_list()[case_idx]
+    max_item = case_item.content[database.index.image_row_item[row]]
+    return RetrievalResult(case_item.case_id, case_item.name, score,
+                           case_item.web_link,
+                           "image match", max_item, (max_item.category, "image"),
+                           None, image_row=row)
+
+
 def multi_modal_query(
         database: CaseDatabase, 
         query: EnrichedQuery,
+        rerank: int = None,
+        shortlist: int = None,
         **kwargs
         ) -> List[RetrievalResult]:
     """
-    Query the database, return unsorted retrieval results
+    Query the database, return the retrieval results sorted by score.
+    Cases without images are left out.
     """
-    retrieval_results = []
-
-    np_query_embs = query.txt_multi_modal_embedding # shape: (emb_dim, )
-
-    for _, case_item in database.cases.items():
-        img_embs = case_item.get_all_image_embeddings()
-        if len(img_embs) == 0:
-            continue
-        img_embs = np.array(img_embs)  # shape: (entry_count, emb_dim)
-        # normalize the length of the embeddings
-        img_embs = img_embs / np.linalg.norm(img_embs, axis=1)[:, np.newaxis]
-        raw_dot_product = np.dot(img_embs, np_query_embs.T)  # shape: (entry_count, )
-        dot_product = raw_dot_product
-
-        # concatenate the similarities
-        max_dot_product = np.max(dot_product)
-        max_item_idx = np.argmax(dot_product)
-        max_item = case_item.look_up_image(max_item_idx)
-        retrieval_results.append(
-            RetrievalResult(case_item.case_id, case_item.name, max_dot_product, 
-                            case_item.web_link,
-                            "image match", max_item, (max_item.category, "image"),
-                            None))
-                
-    retrieval_results.sort(key=lambda x: x.score, reverse=True)
-    return retrieval_results
+    scores, max_rows = image_case_scores(database, query, rerank, shortlist)
+    return [image_result(database, case_idx, max_rows[case_idx], scores[case_idx])
+            for case_idx in ranked_cases(scores)]
@@ -1,37 +1,62 @@
-from retrieval.fusion_query import fusion_query
+from retrieval.fusion_query import fusion_query, embed_query_set
 from retrieval.query_preprocess import query_preprocess
 from utils.app_types import CaseDatabase, QuerySet, RetrievalResult, DesignCase
+from utils.index_bundle import BUNDLE_FOLDER, bundle_exists, load_bundle, build_bundle, bundle_to_database, load_case_pickle
+from utils.providers import configure_provider, PROVIDERS
 from pathlib import Path
-import pickle
 from collections import OrderedDict
 import logging
+import random
 from typing import List, Tuple, Union, Literal, Dict
 
 
+def index_manifest(database_folder_path: str) -> Tuple[Tuple[str, int, int], ...]:
+    """
+    Snapshot (name, size, mtime) of the index files, used to detect index changes
+    """
+    database_folder_path = Path(database_folder_path)
+    if bundle_exists(database_folder_path):
+        index_files = list((database_folder_path / BUNDLE_FOLDER).glob("*"))
+    else:
+        index_files = list(database_folder_path.glob("*.pkl"))
+    manifest = []
+    for index_file in sorted(index_files):
+        try:
+            stat = index_file.stat()
+        except FileNotFoundError:
+            continue
+        manifest.append((str(index_file.relative_to(database_folder_path)), stat.st_size, stat.st_mtime_ns))
+    return tuple(manifest)
+
+
 def load_database(database_folder_path: str) -> CaseDatabase:
     """
-    Load the database
+    Load the database from the index bundle,
+    fall back to the per-case pkl files for indexes built before the bundle format
     """
+    if bundle_exists(database_folder_path):
+        return bundle_to_database(load_bundle(database_folder_path))
+
     # load all pkl files from the database folder
-    database_cases = OrderedDict()
-    for pkl_file in Path(database_folder_path).glob("*.pkl"):
+    cases = []
+    for pkl_file in sorted(Path(database_folder_path).glob("*.pkl")):
         try:
-            with open(pkl_file, "rb") as f:
-                case: DesignCase = pickle.load(f)
-                case_idx = case.case_id
-                database_cases[case_idx] = case
+            cases.append(load_case_pickle(pkl_file))
         except Exception as e:
             logging.error(f"Error loading {pkl_file}: {e}")
-    return CaseDatabase(database_cases)
+    return bundle_to_database(build_bundle(cases), cases)
 
 
 def query_handler(database: Union[str, CaseDatabase],
                   query: Union[str, QuerySet, None], 
                   selected_ids: List[int] = None,
+                  k: int = None,
+                  offset: int = 0,
                   **kwargs,
-                  ) -> Tuple[List[RetrievalResult], QuerySet]:
+                  ) -> Tuple[List[RetrievalResult], QuerySet, int]:
     """
-    Handle the query, return the retrieval results and the query set
+    Handle the query, return the page of k retrieval results starting at offset
+    (all results if k is None), the query set and the total number of results
     """
     # preprocess the query
     if isinstance(query, QuerySet):
@@ -45,16 +70,25 @@ def query_handler(database: Union[str, CaseDatabase],
     else:
         query_set = QuerySet([],[])
 
+    # the random results of the query set keep their order across pages
+    if query_set.seed is None:
+        query_set.seed = random.getrandbits(32)
+
     # load the database
     if isinstance(database, str):
         database_folder_path = database
         database = load_database(database_folder_path)
 
+    # embed the new queries, the returned query set keeps the embeddings
+    # so that later adjustments of the query set do not embed them again
+    if kwargs.get("mode") != "random":
+        query_set = embed_query_set(query_set)
+
     # query the database
-    retrieval_results = fusion_query(database, query_set, **kwargs)
+    retrieval_results, total = fusion_query(database, query_set, k=k, offset=offset, **kwargs)
 
     # return the results
-    return retrieval_results, query_set
+    return retrieval_results, query_set, total
 
 
 if __name__ == "__main__":
@@ -64,8 +98,13 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Query the database")
     parser.add_argument("--database", type=str, help="Path to the database folder", default="data/example_index")
     parser.add_argument("--query", type=str, help="The query string", default="red brick")
+    parser.add_argument("--k", type=int, help="Number of results to return", default=3)
+    parser.add_argument("--offset", type=int, help="Number of results to skip", default=0)
+    parser.add_argument("--provider", type=str, help="Model provider", default="openai", choices=list(PROVIDERS))
     args = parser.parse_args()
+    configure_provider(args.provider)
      # handle the query
-    result = query_handler(args.database, args.query)
+    results, query_set, total = query_handler(args.database, args.query, k=args.k, offset=args.offset)
      # print the results
-    print(result[:3])
\ No newline at end of file
+    print(f"{total} results")
+    print(results)
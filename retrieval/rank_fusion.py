@@ -0,0 +1,90 @@
+from retrieval.scoring import top_cases
+from dataclasses import dataclass
+from typing import List, Literal, Tuple
+import numpy as np
+
+
+FusionMethod = Literal["rrf", "score"]
+
+
+@dataclass
+class RankedList:
+    """
+    Cases of one retrieval arm in rank order, identified by their index in the database
+    """
+    case_indices: np.ndarray  # (n, ) best case first
+    scores: np.ndarray        # (n, ) score of each ranked case
+    weight: float = 1.0
+    candidate_count: int = None  # number of ranked cases before truncation to the top
+
+    def __post_init__(self):
+        if self.candidate_count is None:
+            self.candidate_count = len(self.case_indices)
+
+    @staticmethod
+    def from_case_scores(case_scores: np.ndarray, weight: float = 1.0, top: int = None) -> "RankedList":
+        """
+        Rank the cases by their score, cases with a -inf score are left out.
+        If top is given, only the best top cases are kept.
+        """
+        case_indices = top_cases(case_scores, top)
+        return RankedList(case_indices, case_scores[case_indices], weight,
+                          int(np.count_nonzero(np.isfinite(case_scores))))
+
+    def ranks(self, case_count: int) -> np.ndarray:
+        """
+        Rank of each case, -1 if the case is not in the list
+        """
+        ranks = np.full(case_count, -1, dtype=np.int64)
+        ranks[self.case_indices] = np.arange(len(self.case_indices))
+        return ranks
+
+
+def fuse(ranked_lists: List[RankedList],
+         case_count: int,
+         method: FusionMethod = "rrf",
+         k: float = 10,
+         top: int = None,
+         ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fuse weighted ranked lists.
+    rrf adds weight / (rank + k) of every list a case appears in,
+    score adds weight * score.
+    Return the fused score of each case (-inf if it is in no list) and the
+    fused ranking, or only its best top cases. Ties keep the order in which
+    the cases first appear in the lists.
+    """
+    fused_scores = np.zeros(case_count)
+    first_seen = np.full(case_count, np.iinfo(np.int64).max, dtype=np.int64)
+    present = np.zeros(case_count, dtype=bool)
+    seen_offset = 0
+    for ranked_list in ranked_lists:
+        case_indices = ranked_list.case_indices
+        ranks = np.arange(len(case_indices))
+        if method == "rrf":
+            fused_scores[case_indices] += 1 / (ranks + k) * ranked_list.weight
+        elif method == "score":
+            fused_scores[case_indices] += ranked_list.scores * ranked_list.weight
+        else:
+            raise ValueError(f"Unknown fusion method {method}")
+
+        is_new = ~present[case_indices]
+        first_seen[case_indices[is_new]] = seen_offset + ranks[is_new]
+        present[case_indices] = True
+        seen_offset += len(case_indices)
+
+    fused_scores[~present] = -np.inf
+    return fused_scores, top_cases(fused_scores, top, first_seen)
+
+
+def fuse_ranked_lists(ranked_lists: List[RankedList],
+                      case_count: int,
+                      method: FusionMethod = "rrf",
+                      k: float = 10,
+                      weight: float = 1.0,
+                      ) -> RankedList:
+    """
+    Fuse ranked lists into a new ranked list, which can be fused again
+    """
+    fused_scores, order = fuse(ranked_lists, case_count, method, k)
+    return RankedList(order, fused_scores[order], weight)
@@ -0,0 +1,117 @@
+from typing import Callable, Tuple
+import numpy as np
+
+
+def segment_argmax(values: np.ndarray, offsets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Max and argmax of each segment values[offsets[i]:offsets[i+1]].
+    Empty segments get -inf and -1. The argmax is the global row index,
+    ties resolve to the first row like np.argmax.
+    """
+    case_count = len(offsets) - 1
+    seg_max = np.full(case_count, -np.inf)
+    seg_arg = np.full(case_count, -1, dtype=np.int64)
+
+    counts = np.diff(offsets)
+    non_empty = counts > 0
+    if len(values) == 0 or not non_empty.any():
+        return seg_max, seg_arg
+
+    starts = offsets[:-1][non_empty]
+    max_values = np.maximum.reduceat(values, starts)
+    seg_max[non_empty] = max_values
+
+    # the first row of each segment that reaches the segment max
+    row_max = np.repeat(max_values, counts[non_empty])
+    row_ids = np.where(values == row_max, np.arange(len(values)), len(values))
+    seg_arg[non_empty] = np.minimum.reduceat(row_ids, starts)
+    return seg_max, seg_arg
+
+
+def candidate_case_scores(values: np.ndarray, rows: np.ndarray, offsets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Max and argmax of each segment when only the sorted candidate rows are scored,
+    values[i] is the score of rows[i]. Segments without a candidate get -inf and -1.
+    """
+    # the candidates of segment i are rows[candidate_offsets[i]:candidate_offsets[i+1]]
+    candidate_offsets = np.searchsorted(rows, offsets)
+    seg_max, candidate_idx = segment_argmax(values, candidate_offsets)
+    seg_arg = np.full(len(seg_max), -1, dtype=np.int64)
+    found = candidate_idx >= 0
+    seg_arg[found] = rows[candidate_idx[found]]
+    return seg_max, seg_arg
+
+
+def drop_removed(case_scores: np.ndarray, max_rows: np.ndarray, removed: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Give the cases removed from a patched index -inf and -1, they keep their rows
+    in the bundle but no ranking returns them
+    """
+    if removed is None or not removed.any():
+        return case_scores, max_rows
+    case_scores, max_rows = case_scores.copy(), max_rows.copy()
+    case_scores[removed] = -np.inf
+    max_rows[removed] = -1
+    return case_scores, max_rows
+
+
+def top_cases(scores: np.ndarray, top: int = None, tiebreak: np.ndarray = None) -> np.ndarray:
+    """
+    Case indices sorted by descending score, ties resolve by ascending tiebreak
+    (the database order by default). Cases with -inf scores are left out.
+    If top is given, only the best top cases are selected with argpartition
+    and sorted, the rest is never ordered.
+    """
+    candidates = np.flatnonzero(np.isfinite(scores))
+    if top is not None and top < len(candidates):
+        if top <= 0:
+            return candidates[:0]
+        candidate_scores = scores[candidates]
+        kth = np.argpartition(-candidate_scores, top - 1)[top - 1]
+        # keep every case tied with the last selected one, the tiebreak decides among them
+        candidates = candidates[candidate_scores >= candidate_scores[kth]]
+    keys = candidates if tiebreak is None else tiebreak[candidates]
+    order = np.lexsort((keys, -scores[candidates]))
+    return candidates[order][:top]
+
+
+def ranked_cases(scores: np.ndarray) -> np.ndarray:
+    """
+    Case indices sorted by descending score, ties keep the database order.
+    Cases with -inf scores have no rows and are left out.
+    """
+    return top_cases(scores)
+
+
+def segment_rows(offsets: np.ndarray, segments: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Rows of the given segments concatenated in order, and the offsets of each segment
+    inside the concatenation
+    """
+    counts = offsets[segments + 1] - offsets[segments]
+    sub_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    rows = np.repeat(offsets[segments] - sub_offsets[:-1], counts) + np.arange(sub_offsets[-1])
+    return rows, sub_offsets
+
+
+def rerank_cases(case_scores: np.ndarray,
+                 max_rows: np.ndarray,
+                 offsets: np.ndarray,
+                 row_scores: Callable[[np.ndarray], np.ndarray],
+                 top: int,
+                 ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Score all rows of the best top cases again with row_scores(rows)
+    and replace their max score and max row
+    """
+    cases = np.sort(top_cases(case_scores, top))
+    if len(cases) == 0:
+        return case_scores, max_rows
+    rows, sub_offsets = segment_rows(offsets, cases)
+    seg_max, seg_arg = segment_argmax(row_scores(rows), sub_offsets)
+    case_scores, max_rows = case_scores.copy(), max_rows.copy()
+    case_scores[cases] = seg_max
+    found = seg_arg >= 0
+    max_rows[cases[found]] = rows[seg_arg[found]]
+    max_rows[cases[~found]] = -1
+    return case_scores, max_rows
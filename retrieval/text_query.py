@@ -1,43 +1,148 @@
-from utils.app_types import CaseDatabase, EnrichedQuery, RetrievalResult, RawTextItem, DesignCase, FilterWeight, empty_filter_weights
-from typing import List
+from utils.app_types import CaseDatabase, EnrichedQuery, RetrievalResult, RawTextItem, DesignCase, FilterWeight, empty_filter_weights, RAW_TEXT_FILTER_CODE
+from retrieval.scoring import segment_argmax, candidate_case_scores, ranked_cases, rerank_cases, drop_removed
+from utils.quantization import exact_rows, has_exact_copy
+from utils.sketch import hamming_shortlist
+from typing import List, Tuple
 import numpy as np
 
+
+def text_row_weights(database: CaseDatabase, query: EnrichedQuery) -> np.ndarray:
+    """
+    Filter weights of all text rows, shape: (text_rows, ).
+    One gather of the query weight vector by the row filter codes,
+    rows with a zero weight get the mean non-zero weight of their case.
+    """
+    index = database.index
+    row_weights = query.weight_vector()[index.text_row_filter]
+
+    counts = np.diff(index.text_offsets)
+    non_empty = counts > 0
+    if len(row_weights) == 0:
+        return row_weights
+    starts = index.text_offsets[:-1][non_empty]
+    is_weighted = row_weights != 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        case_mean = np.add.reduceat(np.where(is_weighted, row_weights, 0), starts) \
+            / np.add.reduceat(is_weighted.astype(float), starts)
+    return np.where(is_weighted, row_weights, np.repeat(case_mean, counts[non_empty]))
+
+
+def text_row_scores(
+        database: CaseDatabase,
+        query_embs: np.ndarray,
+        row_weights: np.ndarray,
+        rows: np.ndarray = None,
+        text_only: bool = False,
+        exact: bool = False,
+        ) -> np.ndarray:
+    """
+    Weighted scores of the given text rows, all rows if rows is None.
+    exact reads the float32 copy of a quantized index.
+    """
+    index = database.index
+    if rows is None:
+        dot_product = (index.text_embeddings @ query_embs) * row_weights
+        row_filter = index.text_row_filter
+    else:
+        matrix_rows = exact_rows(index.text_embeddings, rows) if exact else index.text_embeddings[rows]
+        dot_product = (matrix_rows @ query_embs) * row_weights[rows]
+        row_filter = index.text_row_filter[rows]
+    if text_only:
+        dot_product[row_filter != RAW_TEXT_FILTER_CODE] = -np.inf
+    return dot_product
+
+
+def text_candidate_rows(
+        database: CaseDatabase,
+        query_embs: np.ndarray,
+        nprobe: int = None,
+        shortlist: int = None,
+        ) -> np.ndarray:
+    """
+    Sorted text rows worth scoring, None if every row has to be scored.
+    nprobe keeps the rows of the closest ANN lists, shortlist keeps the
+    rows closest in Hamming distance of the sign sketches.
+    """
+    index = database.index
+    rows = None
+    if nprobe and index.ann is not None and nprobe < index.ann.list_count:
+        rows = index.ann.search(query_embs, nprobe)
+    if shortlist and index.text_sketch is not None:
+        if shortlist < (len(index.text_sketch) if rows is None else len(rows)):
+            rows = hamming_shortlist(index.text_sketch, query_embs, shortlist, rows)
+    return rows
+
+
+def text_case_scores(
+        database: CaseDatabase,
+        query: EnrichedQuery,
+        text_only: bool = False,
+        nprobe: int = None,
+        rerank: int = None,
+        shortlist: int = None,
+        ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Score the text rows with one matrix-vector product,
+    return the max score of each case and the row reaching it.
+    nprobe and shortlist restrict the scored rows to candidates of the
+    ANN index and the sign sketches, cases without a candidate get -inf and -1.
+    If rerank is given and the index is quantized with an exact copy,
+    the best rerank cases are scored again on the float32 rows.
+    """
+    index = database.index
+    np_query_embs = np.asarray(query.txt_embedding, dtype=np.float32)  # shape: (emb_dim, )
+    row_weights = text_row_weights(database, query)
+    rows = text_candidate_rows(database, np_query_embs, nprobe, shortlist)
+    dot_product = text_row_scores(database, np_query_embs, row_weights, rows, text_only)
+    if rows is None:
+        case_scores, max_rows = segment_argmax(dot_product, index.text_offsets)
+    else:
+        case_scores, max_rows = candidate_case_scores(dot_product, rows, index.text_offsets)
+    case_scores, max_rows = drop_removed(case_scores, max_rows, index.removed)
+
+    if rerank and has_exact_copy(index.text_embeddings):
+        case_scores, max_rows = rerank_cases(
+            case_scores, max_rows, index.text_offsets,
+            lambda rows: text_row_scores(database, np_query_embs, row_weights, rows, text_only, exact=True),
+            rerank)
+    return case_scores, max_rows
+
+
+def text_result(database: CaseDatabase, case_idx: int, row: int, score: float) -> RetrievalResult:
+    """
+    Build the retrieval result of a case from its best text row
+    """
+    index = database.index
+    case_item: DesignCase = database.case_list()[case_idx]
+    emb_idx = row - index.text_offsets[case_idx]
+    max_item = case_item.content[index.text_row_item[row]]
+    max_entry = case_item.all_texts[emb_idx]
+    item_filter = case_item.look_up_filter(emb_idx)
+    if isinstance(max_item, RawTextItem) or ("txt" in str(max_item.asset_path)):
+        # use any image item for visualization
+        for item in case_item.content:
+            if "txt" not in str(item.asset_path):
+                max_item = item
+                break
+    return RetrievalResult(case_item.case_id, case_item.name, score,
+                           case_item.web_link,
+                           max_entry, max_item, item_filter,
+                           text_row=row,
+                           )
+
+
 def text_based_query(
         database: CaseDatabase, 
         query: EnrichedQuery,
         text_only: bool = False,
+        nprobe: int = None,
+        rerank: int = None,
+        shortlist: int = None,
         **kwargs
         ) -> List[RetrievalResult]:
     """
-    Query the database, return unsorted retrieval results
-    """
-    retrieval_results = []
-
-    query_embs = query.txt_embedding
-    np_query_embs = np.array(query_embs)  # shape: (emb_dim, )
-
-    for _, case_item in database.cases.items():
-        weights = case_item.get_emb_weights(query.weights, text_only) # shape: (entry_count, )
-        raw_dot_product = np.dot(case_item.embeddings, np_query_embs.T)  # shape: (entry_count,)
-        dot_product = raw_dot_product * weights
-
-        # concatenate the similarities
-        max_dot_product = np.max(dot_product)
-        max_item_idx = np.argmax(dot_product)
-        max_item, max_entry = case_item.look_up_content(max_item_idx)
-        item_filter = case_item.look_up_filter(max_item_idx)
-        if isinstance(max_item, RawTextItem) or ("txt" in str(max_item.asset_path)):
-            # use any image item for visualization
-            for item in case_item.content:
-                if "txt" not in str(item.asset_path):
-                    max_item = item
-                    break
-        retrieval_results.append(
-            RetrievalResult(case_item.case_id, case_item.name, max_dot_product, 
-                            case_item.web_link,
-                            max_entry, max_item, item_filter,
-                            ))
-        
-    retrieval_results.sort(key=lambda x: x.score, reverse=True)
-    return retrieval_results
-    
+    Query the database, return the retrieval results sorted by score
+    """
+    scores, max_rows = text_case_scores(database, query, text_only, nprobe, rerank, shortlist)
+    return [text_result(database, case_idx, max_rows[case_idx], scores[case_idx])
+            for case_idx in ranked_cases(scores)]
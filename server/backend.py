@@ -6,6 +6,12 @@ from server.results_to_html import results_to_html_dict
 import secrets
 import os
 from server.database import NaiveDatabase
+from server.index_cache import IndexCache
+from utils.embedding_cache import configure_embedding_cache, get_embedding_cache
+from utils.image_cache import configure_image_cache, get_image_cache, DEFAULT_IMAGE_CACHE_BYTES
+from utils.rate_limit import configure_rate_limits
+from utils.http_clients import configure_http_clients
+from utils.providers import configure_provider
 
 
 class Backend_Api:
@@ -13,12 +19,32 @@ class Backend_Api:
         self.app = app
         self.config = config
         self.index_dir_path = config['index_directory']
+        self.index = IndexCache(self.index_dir_path, config.get('index_poll_interval', 5.0))
+        self.page_size = config.get('page_size', 30)
+        # search options passed to every query, nprobe only applies to indexes built with --ann,
+        # rerank to quantized indexes built with --exact, shortlist to indexes built with --sketch
+        self.search_options = {'nprobe': config.get('ann', {}).get('nprobe'),
+                               'rerank': config.get('quantization', {}).get('rerank'),
+                               'shortlist': config.get('sketch', {}).get('shortlist')}
         self.database = NaiveDatabase(max_size=100)
+        cache_config = config.get('embedding_cache', {})
+        configure_embedding_cache(cache_config.get('directory'), cache_config.get('max_entries', 4096))
+        image_cache_config = config.get('image_cache', {})
+        configure_image_cache(image_cache_config.get('directory'),
+                              int(image_cache_config.get('max_mb', DEFAULT_IMAGE_CACHE_BYTES / 2 ** 20) * 2 ** 20))
+        configure_rate_limits(config.get('rate_limits', {}))
+        configure_http_clients(config.get('http', {}))
+        # "local" serves the queries offline, for load tests
+        configure_provider(**config.get('provider', {'name': 'openai'}))
         self.routes = {
             '/backend-api/query': {
                 'function': self._query,
                 'methods': ['POST']
             },
+            '/backend-api/page': {
+                'function': self._page,
+                'methods': ['POST']
+            },
             '/backend-api/add_item': {
                 'function': self._add_item,
                 'methods': ['POST']
@@ -31,6 +57,10 @@ class Backend_Api:
                 'function': self._apply_weights,
                 'methods': ['POST']
             },
+            '/backend-api/cache-stats': {
+                'function': self._cache_stats,
+                'methods': ['GET']
+            },
             '/backend-api/img/<path:subpath>': {
                 'function': self._load_img,
                 'methods': ['GET']
@@ -47,6 +77,9 @@ class Backend_Api:
             session_id = secrets.token_hex(16)
         return session_id
 
+    def _cache_stats(self):
+        return {'embedding_cache': get_embedding_cache().stats(), 'image_cache': get_image_cache().stats()}
+
     def _load_img(self, subpath):
         try:
             later_path = os.path.normpath(subpath)
@@ -73,6 +106,34 @@ class Backend_Api:
                 'success': False,
                 "error": f"an error occurred {str(e)}"}, 400
         
+    def _page_args(self):
+        """
+        Page size and offset of the request, the first page by default
+        """
+        k = int(request.form.get('k', self.page_size))
+        offset = int(request.form.get('offset', 0))
+        return k, offset
+
+    def _update_entry_dict(self, user_id, results, database, offset: int) -> None:
+        """
+        A new first page replaces the stored entries, further pages extend them
+        """
+        entry_dict = self._entry_dict(results, database)
+        if offset > 0:
+            entry_dict = {**(self.database.get(user_id, 'entry_dict') or {}), **entry_dict}
+        self.database.update_or_insert(user_id, 'entry_dict', entry_dict)
+
+    def _entry_dict(self, results, database) -> dict:
+        """
+        Best entry of each result with its index rows, used when the user likes a case
+        """
+        entry_dict = {}
+        for result in results:
+            entry = result.to_app_dict()
+            entry['index_id'] = database.index.index_id if database.index is not None else None
+            entry_dict[entry['case_id']] = entry
+        return entry_dict
+
     def _query(self):
         user_id = self._get_session_id()
 
@@ -80,15 +141,30 @@ class Backend_Api:
         input_data = request.form['inputData']
 
         # Here you can call your Python function with input_data as the argument
-        results, query_set = query_handler(self.index_dir_path, input_data)
+        database = self.index.database
+        k, offset = self._page_args()
+        results, query_set, total = query_handler(database, input_data, k=k, offset=offset,
+                                                  **self.search_options)
 
         # update the global query set
         self.database.update_or_insert(user_id, 'global_query_set', query_set.to_dict())
-        entry_list = [result.to_app_dict() for result in results]
-        entry_dict = {entry['case_id']: entry['max_entry'] for entry in entry_list}
-        self.database.update_or_insert(user_id, 'entry_dict', entry_dict)
+        self._update_entry_dict(user_id, results, database, offset)
 
-        results_dict = results_to_html_dict(results, query_set)
+        results_dict = results_to_html_dict(results, query_set, total, offset)
+        return results_dict
+
+    def _page(self):
+        user_id = self._get_session_id()
+        # rerun the stored query set for another page of results
+        query_set = self.database.get(user_id, 'global_query_set')
+        query_set = QuerySet.from_dict(query_set)
+
+        database = self.index.database
+        k, offset = self._page_args()
+        results, query_set, total = query_handler(database, query_set, k=k, offset=offset,
+                                                  **self.search_options)
+        self._update_entry_dict(user_id, results, database, offset)
+        results_dict = results_to_html_dict(results, query_set, total, offset)
         return results_dict
 
     def _add_item(self):
@@ -99,15 +175,16 @@ class Backend_Api:
         query_set = self.database.get(user_id, 'global_query_set')
         entry_dict = self.database.get(user_id, 'entry_dict')
         query_set= QuerySet.from_dict(query_set)
-        query_set = add_item_to_query_set(query_set, entry_dict, add_id)
+        database = self.index.database
+        query_set = add_item_to_query_set(query_set, entry_dict, add_id, database)
 
         # rerun the query
-        results, query_set = query_handler(self.index_dir_path, query_set)
+        k, offset = self._page_args()
+        results, query_set, total = query_handler(database, query_set, k=k, offset=offset,
+                                                  **self.search_options)
         self.database.update_or_insert(user_id, 'global_query_set', query_set.to_dict())
-        entry_list = [result.to_app_dict() for result in results]
-        entry_dict = {entry['case_id']: entry['max_entry'] for entry in entry_list}
-        self.database.update_or_insert(user_id, 'entry_dict', entry_dict)
-        results_dict = results_to_html_dict(results, query_set)
+        self._update_entry_dict(user_id, results, database, offset)
+        results_dict = results_to_html_dict(results, query_set, total, offset)
         return results_dict
 
     def _remove_item(self):
@@ -120,12 +197,13 @@ class Backend_Api:
         query_set = remove_item_from_query_set(query_set, remove_id)
 
         # rerun the query
-        results, query_set = query_handler(self.index_dir_path, query_set)
+        database = self.index.database
+        k, offset = self._page_args()
+        results, query_set, total = query_handler(database, query_set, k=k, offset=offset,
+                                                  **self.search_options)
         self.database.update_or_insert(user_id, 'global_query_set', query_set.to_dict())
-        entry_list = [result.to_app_dict() for result in results]
-        entry_dict = {entry['case_id']: entry['max_entry'] for entry in entry_list}
-        self.database.update_or_insert(user_id, 'entry_dict', entry_dict)
-        results_dict = results_to_html_dict(results, query_set)
+        self._update_entry_dict(user_id, results, database, offset)
+        results_dict = results_to_html_dict(results, query_set, total, offset)
         return results_dict
 
     def _apply_weights(self):
@@ -140,10 +218,11 @@ class Backend_Api:
         query_set.weights = weights
 
         # rerun the query
-        results, query_set = query_handler(self.index_dir_path, query_set)
+        database = self.index.database
+        k, offset = self._page_args()
+        results, query_set, total = query_handler(database, query_set, k=k, offset=offset,
+                                                  **self.search_options)
         self.database.update_or_insert(user_id, 'global_query_set', query_set.to_dict())
-        entry_list = [result.to_app_dict() for result in results]
-        entry_dict = {entry['case_id']: entry['max_entry'] for entry in entry_list}
-        self.database.update_or_insert(user_id, 'entry_dict', entry_dict)
-        results_dict = results_to_html_dict(results, query_set)
+        self._update_entry_dict(user_id, results, database, offset)
+        results_dict = results_to_html_dict(results, query_set, total, offset)
         return results_dict
\ No newline at end of file
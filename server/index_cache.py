@@ -0,0 +1,68 @@
+from retrieval.query import load_database, index_manifest
+from utils.app_types import CaseDatabase
+from utils.index_bundle import BUNDLE_FOLDER, BUNDLE_META_FILE, extend_database
+from pathlib import Path
+import threading
+import logging
+
+
+# keep the case database resident in memory
+# a background thread polls the index folder and swaps in a freshly
+# loaded database when the folder content changes, so request handlers
+# only ever read the in-memory copy. Cases added or removed by
+# preprocess.build add|update|remove are applied from the bundle log
+# without reloading the other cases
+class IndexCache:
+    def __init__(self, index_dir_path: str, poll_interval: float = 5.0):
+        self.index_dir_path = index_dir_path
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._manifest = index_manifest(index_dir_path)
+        self._database = load_database(index_dir_path)
+        self._stop_event = threading.Event()
+        self._watcher = None
+        if poll_interval and poll_interval > 0:
+            self._watcher = threading.Thread(target=self._watch, daemon=True)
+            self._watcher.start()
+
+    @property
+    def database(self) -> CaseDatabase:
+        return self._database
+
+    def refresh(self) -> bool:
+        """
+        Reload the database if the index folder changed since the last load.
+        Return True if a reload happened.
+        """
+        with self._lock:
+            manifest = index_manifest(self.index_dir_path)
+            if manifest == self._manifest:
+                return False
+            if self._same_bundle(manifest):
+                logging.info(f"Index bundle {self.index_dir_path} patched, applying the log")
+                database = extend_database(self._database, self.index_dir_path)
+            else:
+                logging.info(f"Index folder {self.index_dir_path} changed, reloading")
+                database = load_database(self.index_dir_path)
+            self._database = database
+            self._manifest = manifest
+            return True
+
+    def _same_bundle(self, manifest) -> bool:
+        """
+        Whether the loaded bundle is still in place and only its log and arrays grew
+        """
+        meta_name = str(Path(BUNDLE_FOLDER) / BUNDLE_META_FILE)
+        old_meta = [entry for entry in self._manifest if entry[0] == meta_name]
+        return bool(old_meta) and old_meta == [entry for entry in manifest if entry[0] == meta_name] \
+            and getattr(self._database.index, 'removed', None) is not None
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def _watch(self) -> None:
+        while not self._stop_event.wait(self.poll_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error(f"Error reloading index {self.index_dir_path}: {e}")
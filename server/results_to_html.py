@@ -3,6 +3,8 @@ from typing import List
 
 def results_to_html_dict(results: List[RetrievalResult],
                          query_set: QuerySet,
+                         total: int = None,
+                         offset: int = 0,
                          ) -> dict:
     """
     Convert the results to a list of dictionaries for HTML rendering
@@ -30,4 +32,7 @@ def results_to_html_dict(results: List[RetrievalResult],
             'weight': weight,
         })
     selected_flags = [1 if result.case_id in query_set.selected_ids else 0 for result in results]
-    return {"result": results_list, "query": query_list, "image_path": query_set.image_path, "selected": selected_flags}
\ No newline at end of file
+    if total is None:
+        total = offset + len(results)
+    return {"result": results_list, "query": query_list, "image_path": query_set.image_path, "selected": selected_flags,
+            "total": total, "offset": offset}
\ No newline at end of file
@@ -0,0 +1,33 @@
+import numpy as np
+
+from utils.sketch import sign_sketch, hamming_distances, hamming_shortlist
+
+
+def _reference_distances(matrix: np.ndarray, query: np.ndarray) -> np.ndarray:
+    return ((matrix > 0) != (query > 0)).sum(axis=1)
+
+
+def test_hamming_distances_match_sign_bits():
+    rng = np.random.default_rng(0)
+    matrix = rng.standard_normal((50, 1024)).astype(np.float32)
+    query = rng.standard_normal(1024).astype(np.float32)
+    distances = hamming_distances(sign_sketch(matrix), query)
+    np.testing.assert_array_equal(distances, _reference_distances(matrix, query))
+
+
+def test_hamming_distances_without_bitwise_count(monkeypatch):
+    # numpy < 2.0 has no np.bitwise_count, the byte table must be used on uint8 values
+    monkeypatch.delattr(np, "bitwise_count", raising=False)
+    rng = np.random.default_rng(1)
+    for dim in (1024, 100):
+        matrix = rng.standard_normal((50, dim)).astype(np.float32)
+        query = rng.standard_normal(dim).astype(np.float32)
+        sketch = sign_sketch(matrix)
+        distances = hamming_distances(sketch, query)
+        np.testing.assert_array_equal(distances, _reference_distances(matrix, query))
+        rows = np.array([3, 7, 20, 41])
+        shortlist = hamming_shortlist(sketch, query, 2, rows)
+        expected = rows[np.argsort(_reference_distances(matrix[rows], query), kind="stable")[:2]]
+        assert set(shortlist) <= set(rows) and len(shortlist) == 2
+        assert sorted(_reference_distances(matrix[shortlist], query)) == \
+            sorted(_reference_distances(matrix[expected], query))
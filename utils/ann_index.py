@@ -0,0 +1,113 @@
+from dataclasses import dataclass
+import numpy as np
+
+
+@dataclass
+class IVFIndex:
+    """
+    Inverted file index over the rows of an embedding matrix.
+    Every row belongs to the list of its closest centroid, the rows of list j are
+    list_rows[list_offsets[j]:list_offsets[j+1]].
+    """
+    centroids: np.ndarray     # (list_count, dim) float32, L2 normalized
+    list_offsets: np.ndarray  # (list_count + 1, ) int64
+    list_rows: np.ndarray     # (rows, ) int64, row indices grouped by list
+
+    @property
+    def list_count(self) -> int:
+        return len(self.centroids)
+
+    def search(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """
+        Rows of the nprobe lists whose centroids score highest against the query,
+        sorted ascending so that they keep the case order of the matrix
+        """
+        nprobe = max(1, min(nprobe, self.list_count))
+        centroid_scores = self.centroids @ np.asarray(query, dtype=np.float32)
+        lists = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        rows = np.concatenate([self.list_rows[self.list_offsets[j]:self.list_offsets[j + 1]] for j in lists])
+        rows.sort()
+        return rows
+
+
+def default_list_count(row_count: int) -> int:
+    """
+    About 4 * sqrt(rows) lists, a list holds a few hundred rows on large indexes
+    """
+    return max(1, min(row_count, int(round(4 * np.sqrt(row_count)))))
+
+
+def _assign(matrix: np.ndarray, centroids: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+    """
+    Index of the closest centroid of each row, computed in batches to bound the memory
+    """
+    labels = np.empty(len(matrix), dtype=np.int64)
+    for start in range(0, len(matrix), batch_size):
+        batch = np.asarray(matrix[start:start + batch_size], dtype=np.float32)
+        labels[start:start + batch_size] = np.argmax(batch @ centroids.T, axis=1)
+    return labels
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return (matrix / np.where(norms == 0, 1, norms)).astype(np.float32)
+
+
+def build_ivf(matrix: np.ndarray,
+              list_count: int = None,
+              iterations: int = 10,
+              sample_size: int = None,
+              seed: int = 0,
+              ) -> IVFIndex:
+    """
+    Train the centroids with spherical k-means on a sample of the rows,
+    then assign every row to its closest centroid
+    """
+    row_count = len(matrix)
+    if row_count == 0:
+        raise ValueError("Cannot build an ANN index without rows")
+    list_count = default_list_count(row_count) if list_count is None else max(1, min(list_count, row_count))
+    sample_size = min(row_count, sample_size or list_count * 64)
+
+    rng = np.random.default_rng(seed)
+    sample_rows = np.sort(rng.choice(row_count, sample_size, replace=False))
+    sample = np.asarray(matrix[sample_rows], dtype=np.float32)
+    centroids = _normalize(sample[rng.choice(sample_size, list_count, replace=False)])
+
+    for _ in range(iterations):
+        labels = _assign(sample, centroids)
+        counts = np.bincount(labels, minlength=list_count)
+        non_empty = counts > 0
+        sums = np.zeros_like(centroids)
+        sums[non_empty] = np.add.reduceat(sample[np.argsort(labels, kind='stable')],
+                                          np.cumsum(counts)[non_empty] - counts[non_empty])
+        # lists that lost all rows restart from a random row
+        empty = np.flatnonzero(~non_empty)
+        sums[empty] = sample[rng.choice(sample_size, len(empty))]
+        centroids = _normalize(sums)
+
+    labels = _assign(matrix, centroids)
+    counts = np.bincount(labels, minlength=list_count)
+    return IVFIndex(
+        centroids=centroids,
+        list_offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        list_rows=np.argsort(labels, kind='stable').astype(np.int64),
+    )
+
+
+def extend_ivf(index: IVFIndex, matrix: np.ndarray, first_row: int) -> IVFIndex:
+    """
+    Add the rows of matrix, numbered from first_row, to the lists of their closest centroid.
+    The centroids are kept, rebuild the index once many rows were added.
+    """
+    counts = np.diff(index.list_offsets)
+    labels = np.concatenate([np.repeat(np.arange(index.list_count), counts),
+                             _assign(matrix, index.centroids)])
+    rows = np.concatenate([index.list_rows, np.arange(first_row, first_row + len(matrix), dtype=np.int64)])
+    order = np.argsort(labels, kind='stable')
+    counts = np.bincount(labels, minlength=index.list_count)
+    return IVFIndex(
+        centroids=index.centroids,
+        list_offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        list_rows=rows[order].astype(np.int64),
+    )
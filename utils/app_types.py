@@ -16,6 +16,29 @@ empty_filter_weights = {(category, topic): None for category in AssetCategory.__
 ItemFilter: TypeAlias = Tuple[AssetCategory, TopicCategory]
 FilterWeight: TypeAlias = Dict[ItemFilter, float]
 
+# integer code of each (category, topic) pair, stored per embedding row in the index
+filter_codes: Dict[ItemFilter, int] = {item_filter: code for code, item_filter in enumerate(default_filter_weights)}
+RAW_TEXT_FILTER_CODE = len(filter_codes)     # raw text chunk, it has no (category, topic)
+UNKNOWN_FILTER_CODE = len(filter_codes) + 1  # category or topic outside of the literals
+FILTER_CODE_COUNT = len(filter_codes) + 2
+
+
+def filter_code(item_filter: ItemFilter) -> int:
+    return filter_codes.get(tuple(item_filter), UNKNOWN_FILTER_CODE)
+
+
+def filter_weight_vector(filter_weights: FilterWeight) -> np.ndarray:
+    """
+    Lookup vector of the filter weights indexed by filter code.
+    Pairs missing from the dict, raw text chunks and unknown pairs get 0.
+    """
+    weight_vector = np.zeros(FILTER_CODE_COUNT, dtype=float)
+    for item_filter, weight in filter_weights.items():
+        code = filter_codes.get(tuple(item_filter))
+        if code is not None:
+            weight_vector[code] = np.nan if weight is None else weight
+    return weight_vector
+
 @dataclass
 class BaseQuestion:
     theme: TopicCategory
@@ -188,9 +211,8 @@ class DesignCase:
                 emb_idx += 1
 
     def get_all_image_embeddings(self) -> List[List[float]]:
-        # if has no attribute mul_emb_idx_to_item, create it
-        if not hasattr(self, 'mul_emb_idx_to_item'):
-            self.mul_emb_idx_to_item: List[AssetItem] = []
+        # rebuild the mapping on every call so that it matches the returned list
+        self.mul_emb_idx_to_item: List[AssetItem] = []
         result = []
         for item in self.content:
             if isinstance(item, AssetItem) and item.category != 'text':
@@ -205,8 +227,49 @@ class DesignCase:
 @dataclass
 class CaseDatabase:
     cases: OrderedDict[str, DesignCase]
+    index: Any = None  # utils.index_bundle.IndexBundle, columnar copy of all embeddings
+    segments: List[DesignCase] = None  # case of every bundle segment, including the removed ones
+
+    def case_list(self) -> List[DesignCase]:
+        """
+        Cases in index order, case i owns the rows of bundle segment i.
+        Cases removed from a patched index keep their segment, they are left out of cases
+        """
+        if self.segments is not None:
+            return self.segments
+        if getattr(self, '_case_list', None) is None or len(self._case_list) != len(self.cases):
+            self._case_list = list(self.cases.values())
+        return self._case_list
+
+    @property
+    def case_count(self) -> int:
+        """
+        Number of bundle segments, the length of the per-case score arrays
+        """
+        return len(self.case_list())
+
+    def live_case_indices(self) -> np.ndarray:
+        removed = getattr(self.index, 'removed', None)
+        if removed is None:
+            return np.arange(self.case_count)
+        return np.flatnonzero(~removed)
     
 
+def embedding_to_bytes(embedding) -> Union[bytes, None]:
+    """
+    Compact float32 form of an embedding for the session state
+    """
+    if embedding is None or len(embedding) == 0:
+        return None
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+
+def embedding_from_bytes(data: Union[bytes, None]) -> Union[np.ndarray, List[float]]:
+    if not data:
+        return []
+    return np.frombuffer(data, dtype=np.float32)
+
+
 @dataclass
 class EnrichedQuery:
     """
@@ -220,17 +283,27 @@ class EnrichedQuery:
     txt_multi_modal_embedding: List[float] = field(default_factory=list)
     img_embedding: List[float] = field(default_factory=list)
 
+    def weight_vector(self) -> np.ndarray:
+        return filter_weight_vector(self.weights)
+
     def to_dict(self) -> Dict[str, Any]:
         return {
             'content': self.content,
             'weights': {f'{category}_{topic}': weight for (category, topic), weight in self.weights.items()},
             'related_id': self.related_id,
+            'txt_embedding': embedding_to_bytes(self.txt_embedding),
+            'txt_multi_modal_embedding': embedding_to_bytes(self.txt_multi_modal_embedding),
+            'img_embedding': embedding_to_bytes(self.img_embedding),
         }
     
     @staticmethod
     def from_dict(query_dict: Dict[str, Any]):
         weights = {tuple(key.split('_')): value for key, value in query_dict['weights'].items()}
-        return EnrichedQuery(query_dict['content'], weights=weights, related_id=query_dict['related_id'])
+        return EnrichedQuery(query_dict['content'], weights=weights, related_id=query_dict['related_id'],
+                             txt_embedding=embedding_from_bytes(query_dict.get('txt_embedding')),
+                             txt_multi_modal_embedding=embedding_from_bytes(query_dict.get('txt_multi_modal_embedding')),
+                             img_embedding=embedding_from_bytes(query_dict.get('img_embedding')),
+                             )
 
 @dataclass
 class QuerySet:
@@ -241,6 +314,7 @@ class QuerySet:
     weights: List[float] = field(default_factory=list)
     image_path: str = None  # image input path used for web page display
     selected_ids: List[int] = field(default_factory=list)
+    seed: int = None  # order of the random results, kept so that the later pages continue it
 
     @staticmethod
     def from_dict(query_dict: Dict[str, Any]):
@@ -248,7 +322,8 @@ class QuerySet:
         weights = query_dict['weights']
         image_path = query_dict['image_path']
         selected_ids = query_dict.get('selected_ids', [])
-        return QuerySet(queries, weights, image_path, selected_ids)
+        seed = query_dict.get('seed')
+        return QuerySet(queries, weights, image_path, selected_ids, seed)
     
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -256,6 +331,7 @@ class QuerySet:
             'weights': self.weights,
             'image_path': self.image_path,
             'selected_ids': self.selected_ids,
+            'seed': self.seed,
         }
 
 
@@ -269,6 +345,8 @@ class RetrievalResult:
     max_item: Union[RawTextItem, AssetItem]
     max_filter: ItemFilter
     raw_scores: List[float] = field(default_factory=list)
+    text_row: int = None   # row of max_entry in the index text matrices
+    image_row: int = None  # row of max_item in the index image matrix
 
     def to_simp_dict(self) -> Dict[str, Any]:
         raw_score_dict = {f'score_{i}': score for i, score in enumerate(self.raw_scores)}
@@ -286,5 +364,7 @@ class RetrievalResult:
         base_dict = {
             'case_id': self.case_id,
             'max_entry': self.max_entry,
+            'text_row': None if self.text_row is None else int(self.text_row),
+            'image_row': None if self.image_row is None else int(self.image_row),
         }
         return base_dict
@@ -0,0 +1,97 @@
+from pathlib import Path
+from typing import Optional
+import threading
+import sqlite3
+import time
+
+
+# eviction frees space down to this fraction of max_bytes, in batches of the oldest entries
+EVICT_LOW_WATER = 0.9
+EVICT_BATCH = 256
+
+
+class DiskCache:
+    """
+    Persistent key-value store of bytes backed by a sqlite file.
+    If max_bytes is set, the least recently used entries are evicted
+    once the stored values exceed it, down to EVICT_LOW_WATER of it.
+    Safe to share between threads and processes.
+    """
+    def __init__(self, path: str, max_bytes: Optional[int] = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False,
+                                     isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        # running total of the stored sizes, so a put does not sum the whole table
+        self._total = self._stored_bytes() if max_bytes is not None else 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            # the access time only matters for eviction
+            if self.max_bytes is not None:
+                self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+            return bytes(row[0])
+
+    def put(self, key: str, value: bytes) -> None:
+        with self._lock:
+            if self.max_bytes is not None:
+                replaced = self._conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+                self._total += len(value) - (replaced[0] if replaced else 0)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                (key, sqlite3.Binary(value), len(value), time.time()),
+            )
+            if self.max_bytes is not None and self._total > self.max_bytes:
+                self._evict()
+
+    def _stored_bytes(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def _evict(self) -> None:
+        """
+        Delete the least recently used entries down to the low-water mark,
+        so the next eviction only runs after that much has been written again
+        """
+        # other processes write to the same file, the running total is only exact for this one
+        self._total = self._stored_bytes()
+        if self._total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * EVICT_LOW_WATER)
+        while self._total > target:
+            rows = self._conn.execute("SELECT key, size FROM entries ORDER BY accessed ASC LIMIT ?",
+                                      (EVICT_BATCH,)).fetchall()
+            if not rows:
+                break
+            evict_keys = []
+            for key, size in rows:
+                if self._total <= target:
+                    break
+                evict_keys.append((key,))
+                self._total -= size
+            self._conn.execute("BEGIN")
+            self._conn.executemany("DELETE FROM entries WHERE key = ?", evict_keys)
+            self._conn.execute("COMMIT")
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._stored_bytes()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,123 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, List
+from utils.llm import LLMHandler
+import threading
+import queue
+import time
+
+
+# limits of one OpenAI embedding request, the token limit leaves room for the estimate error
+MAX_BATCH_TOKENS = 100_000
+MAX_BATCH_ITEMS = 2048
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Upper estimate of the token count, about one token per 3 utf-8 bytes
+    (English text averages about 4 characters per token)
+    """
+    return len(text.encode("utf-8")) // 3 + 1
+
+
+@dataclass
+class _PendingText:
+    text: str
+    tokens: int
+    future: Future
+
+
+class EmbeddingBatcher:
+    """
+    Packs the texts of all callers into embedding requests bounded by
+    max_tokens and max_items, with up to max_in_flight requests at once.
+    A batch is sent once it is full, or max_wait seconds after its first text.
+    While all requests are in flight, new texts keep filling the next batch.
+    """
+    def __init__(self,
+                 max_tokens: int = MAX_BATCH_TOKENS,
+                 max_items: int = MAX_BATCH_ITEMS,
+                 max_in_flight: int = 4,
+                 max_wait: float = 0.05,
+                 embed_fn: Callable[[List[str]], List[List[float]]] = None):
+        self.max_tokens = max_tokens
+        self.max_items = max_items
+        self.max_wait = max_wait
+        self.embed_fn = embed_fn or (lambda texts: LLMHandler().get_text_embeddings_multi(texts))
+        self.request_count = 0
+        self._queue: "queue.Queue[_PendingText]" = queue.Queue()
+        self._slots = threading.Semaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="embedding-batch")
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed the texts, blocking until all of them are back, in the input order
+        """
+        self._start()
+        pending = [_PendingText(text, estimate_tokens(text), Future()) for text in texts]
+        for item in pending:
+            self._queue.put(item)
+        return [item.future.result() for item in pending]
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch, name="embedding-batcher", daemon=True)
+                self._thread.start()
+
+    def _dispatch(self) -> None:
+        batch, batch_tokens, deadline = [], 0, None
+        while True:
+            timeout = None if not batch else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._send(batch)
+                batch, batch_tokens = [], 0
+                continue
+            if batch and (batch_tokens + item.tokens > self.max_tokens or len(batch) >= self.max_items):
+                self._send(batch)
+                batch, batch_tokens = [], 0
+            if not batch:
+                deadline = time.monotonic() + self.max_wait
+            batch.append(item)
+            batch_tokens += item.tokens
+
+    def _send(self, batch: List[_PendingText]) -> None:
+        # wait for a free request slot, the queue keeps filling meanwhile
+        self._slots.acquire()
+        self.request_count += 1
+        self._executor.submit(self._request, batch)
+
+    def _request(self, batch: List[_PendingText]) -> None:
+        try:
+            embeddings = self.embed_fn([item.text for item in batch])
+            if len(embeddings) != len(batch):
+                raise ValueError(f"Got {len(embeddings)} embeddings for {len(batch)} texts")
+        except Exception as e:
+            for item in batch:
+                item.future.set_exception(e)
+        else:
+            for item, embedding in zip(batch, embeddings):
+                item.future.set_result(embedding)
+        finally:
+            self._slots.release()
+
+
+# process wide batcher shared by the cases of a build
+embedding_batcher = EmbeddingBatcher()
+
+
+def configure_embedding_batcher(max_tokens: int = MAX_BATCH_TOKENS,
+                                max_items: int = MAX_BATCH_ITEMS,
+                                max_in_flight: int = 4,
+                                ) -> EmbeddingBatcher:
+    global embedding_batcher
+    embedding_batcher = EmbeddingBatcher(max_tokens, max_items, max_in_flight)
+    return embedding_batcher
+
+
+def get_embedding_batcher() -> EmbeddingBatcher:
+    return embedding_batcher
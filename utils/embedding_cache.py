@@ -0,0 +1,94 @@
+from utils.disk_cache import DiskCache
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Dict
+import numpy as np
+import unicodedata
+import threading
+import hashlib
+import json
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize the unicode form and the whitespace of a text
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingCache:
+    """
+    Cache of embeddings keyed by (model, dimensions, normalized text).
+    A bounded in-memory LRU sits in front of an optional on-disk store.
+    """
+    def __init__(self, directory: Optional[str] = None, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self.memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.store = DiskCache(Path(directory) / "embeddings.sqlite") if directory else None
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, dimensions: Optional[int], text: str) -> str:
+        key_str = json.dumps([model, dimensions, normalize_text(text)], ensure_ascii=False)
+        return hashlib.sha256(key_str.encode("utf-8")).hexdigest()
+
+    def get(self, model: str, dimensions: Optional[int], text: str) -> Optional[np.ndarray]:
+        key = self.make_key(model, dimensions, text)
+        with self._lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return self.memory[key]
+        value = self.store.get(key) if self.store is not None else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            embedding = np.frombuffer(value, dtype=np.float32)
+            self._remember(key, embedding)
+            return embedding
+
+    def put(self, model: str, dimensions: Optional[int], text: str, embedding) -> None:
+        key = self.make_key(model, dimensions, text)
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._remember(key, embedding)
+        if self.store is not None:
+            self.store.put(key, embedding.tobytes())
+
+    def _remember(self, key: str, embedding: np.ndarray) -> None:
+        self.memory[key] = embedding
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                'memory_entries': len(self.memory),
+                'max_entries': self.max_entries,
+                'disk_entries': len(self.store) if self.store is not None else 0,
+            }
+
+
+# process wide cache used by the query path, memory only until configured
+embedding_cache = EmbeddingCache()
+
+
+def configure_embedding_cache(directory: Optional[str] = None, max_entries: int = 4096) -> EmbeddingCache:
+    global embedding_cache
+    embedding_cache = EmbeddingCache(directory, max_entries)
+    return embedding_cache
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    return embedding_cache
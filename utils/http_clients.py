@@ -0,0 +1,98 @@
+from typing import Dict, Optional, Tuple
+import threading
+import os
+
+
+# connection pool and timeouts of the clients shared by all threads of the process.
+# The pool holds at least as many connections as the provider limits allow requests in flight
+DEFAULT_HTTP_SETTINGS = {
+    "pool_size": 32,
+    "timeout": 120.0,        # seconds to wait for a response
+    "connect_timeout": 10.0,
+    "max_retries": 2,        # retries of the OpenAI client on connection errors and 5xx
+}
+
+_settings: Dict[str, float] = dict(DEFAULT_HTTP_SETTINGS)
+_clients: Dict[str, object] = {}
+_lock = threading.Lock()
+
+
+def configure_http_clients(settings: Dict[str, Optional[float]]) -> None:
+    """
+    Set the pool size and timeouts, the clients are created again on their next use
+    """
+    with _lock:
+        for name, value in settings.items():
+            if value is not None and name in _settings:
+                _settings[name] = value
+        for client in _clients.values():
+            # the replicate client has no close, its connections go with it
+            if hasattr(client, "close"):
+                client.close()
+        _clients.clear()
+
+
+def http_timeout() -> Tuple[float, float]:
+    """
+    (connect, read) timeout for requests calls
+    """
+    return _settings["connect_timeout"], _settings["timeout"]
+
+
+def _shared(name: str, create):
+    with _lock:
+        if name not in _clients:
+            _clients[name] = create()
+        return _clients[name]
+
+
+def get_session():
+    """
+    requests.Session with a keep-alive connection pool, for the plain HTTP calls
+    """
+    def create():
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        pool_size = int(_settings["pool_size"])
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+        return session
+    return _shared("session", create)
+
+
+def get_openai_client():
+    """
+    OpenAI client shared by all calls, its connections are kept alive between requests
+    """
+    def create():
+        import httpx
+        from openai import OpenAI, DefaultHttpxClient
+
+        pool_size = int(_settings["pool_size"])
+        http_client = DefaultHttpxClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(_settings["timeout"], connect=_settings["connect_timeout"]),
+        )
+        return OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), http_client=http_client,
+                      timeout=_settings["timeout"], max_retries=int(_settings["max_retries"]))
+    return _shared("openai", create)
+
+
+def get_replicate_client():
+    """
+    Replicate client shared by all calls, its connections are kept alive between requests
+    """
+    def create():
+        import httpx
+        import replicate
+
+        pool_size = int(_settings["pool_size"])
+        return replicate.Client(
+            api_token=os.environ.get("REPLICATE_API_TOKEN"),
+            timeout=httpx.Timeout(_settings["timeout"], connect=_settings["connect_timeout"]),
+            # the client wraps the transport in its retry transport, the pool limits go on the transport
+            transport=httpx.HTTPTransport(
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)),
+        )
+    return _shared("replicate", create)
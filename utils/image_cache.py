@@ -0,0 +1,129 @@
+from utils.disk_cache import DiskCache
+from utils.image_prep import prepare_image, get_image_pool, MODEL_SHORT_SIDE, MAX_IMAGE_BYTES
+from utils.response_cache import content_hash
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+import threading
+import base64
+
+
+# GPT-V works on a 768 pixel short side in high detail, a larger upload is scaled down by the API
+VISION_SHORT_SIDE = 768
+VISION_MAX_BYTES = 1024 * 1024
+DEFAULT_IMAGE_CACHE_BYTES = 512 * 2 ** 20
+
+
+class ImageCache:
+    """
+    Persistent cache of prepared images keyed by the hash of the file content and the target
+    (short side and byte budget), so an unchanged image is decoded and encoded once across builds.
+    The ImageBind path stores the JPEG bytes, the GPT-V path their base64 string.
+    The least recently used entries are evicted above max_bytes.
+    Without a directory nothing is stored and every image is prepared again.
+    """
+    def __init__(self, directory: Optional[str] = None, max_bytes: int = DEFAULT_IMAGE_CACHE_BYTES):
+        self.store = DiskCache(Path(directory) / "images.sqlite", max_bytes) if directory else None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(kind: str, file_bytes: bytes, short_side: int, max_bytes: int) -> str:
+        return content_hash("\0".join([kind, str(short_side), str(max_bytes), content_hash(file_bytes)]))
+
+    def _lookup(self, key: str) -> Optional[bytes]:
+        value = self.store.get(key) if self.store is not None else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def _store(self, key: str, value: bytes) -> None:
+        if self.store is not None:
+            self.store.put(key, value)
+
+    def prepared_images(self,
+                        image_paths: List[Union[str, Path]],
+                        short_side: int = MODEL_SHORT_SIDE,
+                        max_bytes: int = MAX_IMAGE_BYTES,
+                        ) -> List[Optional[bytes]]:
+        """
+        Prepared JPEG bytes of every image in order, the cache misses are prepared in the image pool.
+        None for the images that could not be read.
+        """
+        results: List[Optional[bytes]] = [None] * len(image_paths)
+        missing: Dict[int, str] = {}
+        for idx, image_path in enumerate(image_paths):
+            try:
+                with open(image_path, "rb") as f:
+                    key = self.make_key("image", f.read(), short_side, max_bytes)
+            except OSError:
+                continue
+            results[idx] = self._lookup(key)
+            if results[idx] is None:
+                missing[idx] = key
+        prepared = get_image_pool().prepare([image_paths[idx] for idx in missing], short_side, max_bytes)
+        for (idx, key), image_bytes in zip(missing.items(), prepared):
+            results[idx] = image_bytes
+            if image_bytes is not None:
+                self._store(key, image_bytes)
+        return results
+
+    def prepared_image(self,
+                       image_path: Union[str, Path],
+                       short_side: int = MODEL_SHORT_SIDE,
+                       max_bytes: int = MAX_IMAGE_BYTES,
+                       ) -> bytes:
+        """
+        Prepared JPEG bytes of one image, prepared in the calling thread on a miss
+        """
+        with open(image_path, "rb") as f:
+            key = self.make_key("image", f.read(), short_side, max_bytes)
+        image_bytes = self._lookup(key)
+        if image_bytes is None:
+            image_bytes = prepare_image(image_path, short_side, max_bytes)
+            self._store(key, image_bytes)
+        return image_bytes
+
+    def vision_base64(self,
+                      image_path: Union[str, Path],
+                      short_side: int = VISION_SHORT_SIDE,
+                      max_bytes: int = VISION_MAX_BYTES,
+                      ) -> str:
+        """
+        Base64 of the image prepared for GPT-V, as sent in the data url
+        """
+        with open(image_path, "rb") as f:
+            key = self.make_key("vision-base64", f.read(), short_side, max_bytes)
+        value = self._lookup(key)
+        if value is None:
+            value = base64.b64encode(prepare_image(image_path, short_side, max_bytes))
+            self._store(key, value)
+        return value.decode("ascii")
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self.store) if self.store is not None else 0,
+                'bytes': self.store.total_bytes() if self.store is not None else 0,
+            }
+
+
+# process wide cache shared by the ImageBind and GPT-V paths, disabled until configured
+image_cache = ImageCache()
+
+
+def configure_image_cache(directory: Optional[str] = None, max_bytes: int = DEFAULT_IMAGE_CACHE_BYTES) -> ImageCache:
+    global image_cache
+    image_cache = ImageCache(directory, max_bytes)
+    return image_cache
+
+
+def get_image_cache() -> ImageCache:
+    return image_cache
@@ -0,0 +1,144 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+from PIL import Image
+import multiprocessing
+import threading
+import logging
+import io
+import os
+
+
+# ImageBind resizes the short side of every image to 224 pixels, larger uploads carry no extra detail
+MODEL_SHORT_SIDE = 224
+MAX_IMAGE_BYTES = 256 * 1024
+
+# estimated JPEG bytes per pixel of a photo at each quality, highest quality first.
+# The encode quality is picked from it so that an image is encoded once
+JPEG_BYTES_PER_PIXEL = [(95, 0.75), (90, 0.5), (80, 0.32), (70, 0.24), (50, 0.17), (30, 0.12)]
+
+
+def _target_size(size: Tuple[int, int], short_side: int) -> Tuple[int, int]:
+    width, height = size
+    scale = min(1.0, short_side / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _pick_quality(size: Tuple[int, int], max_bytes: int) -> Tuple[int, Tuple[int, int]]:
+    """
+    Highest quality whose estimated size fits in max_bytes,
+    the lowest quality and a smaller size if none does
+    """
+    pixels = size[0] * size[1]
+    for quality, bytes_per_pixel in JPEG_BYTES_PER_PIXEL:
+        if pixels * bytes_per_pixel <= max_bytes:
+            return quality, size
+    quality, bytes_per_pixel = JPEG_BYTES_PER_PIXEL[-1]
+    scale = (max_bytes / (pixels * bytes_per_pixel)) ** 0.5
+    return quality, (max(1, int(size[0] * scale)), max(1, int(size[1] * scale)))
+
+
+def prepare_image(image_path: Union[str, Path],
+                  short_side: int = MODEL_SHORT_SIDE,
+                  max_bytes: int = MAX_IMAGE_BYTES,
+                  ) -> bytes:
+    """
+    JPEG bytes of the image at the working resolution of the embedding model, at most max_bytes.
+    JPEG files are decoded directly at a reduced scale (draft mode), then resized once
+    and encoded once. A JPEG that is already small enough is returned as is.
+    """
+    with Image.open(image_path) as img:
+        size = _target_size(img.size, short_side)
+        if img.format == "JPEG" and size == img.size and img.mode in ("RGB", "L") \
+                and os.path.getsize(image_path) <= max_bytes:
+            with open(image_path, "rb") as f:
+                return f.read()
+
+        if img.format == "JPEG":
+            # decode at the smallest 1/2, 1/4 or 1/8 scale still larger than the target
+            img.draft("RGB", size)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        quality, size = _pick_quality(size, max_bytes)
+        if img.size != size:
+            img = img.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+        image_bytes = io.BytesIO()
+        img.save(image_bytes, format="JPEG", quality=quality)
+        encoded_bytes = image_bytes.tell()
+        if encoded_bytes > max_bytes:
+            # the estimate missed, encode once more at the size that fits with some margin
+            scale = 0.9 * (max_bytes / encoded_bytes) ** 0.5
+            image_bytes = io.BytesIO()
+            img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))),
+                       Image.Resampling.LANCZOS).save(image_bytes, format="JPEG", quality=quality)
+        return image_bytes.getvalue()
+
+
+def _prepare_or_none(args) -> Optional[bytes]:
+    image_path, short_side, max_bytes = args
+    try:
+        return prepare_image(image_path, short_side, max_bytes)
+    except Exception as e:
+        logging.error(f"Error preparing image {image_path}: {e}")
+        return None
+
+
+class ImagePool:
+    """
+    Process pool preparing the images of a build, the decoding and resizing
+    run outside of the GIL of the threads that send the requests.
+    With one worker the images are prepared in the calling thread.
+    """
+    def __init__(self, workers: int = None):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawned workers do not inherit the locks of the build threads
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def prepare(self,
+                image_paths: List[Union[str, Path]],
+                short_side: int = MODEL_SHORT_SIDE,
+                max_bytes: int = MAX_IMAGE_BYTES,
+                ) -> List[Optional[bytes]]:
+        """
+        Prepared bytes of every image in order, None for the images that could not be read
+        """
+        args = [(image_path, short_side, max_bytes) for image_path in image_paths]
+        if self.workers == 1 or len(args) <= 1:
+            return [_prepare_or_none(arg) for arg in args]
+        try:
+            return list(self._get_executor().map(_prepare_or_none, args))
+        except BrokenProcessPool as e:
+            logging.warning(f"Image pool failed ({e}), preparing the images in this process")
+            self.shutdown()
+            return [_prepare_or_none(arg) for arg in args]
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+# process wide pool, a worker per core unless configured otherwise
+image_pool = ImagePool()
+
+
+def configure_image_pool(workers: int = None) -> ImagePool:
+    global image_pool
+    image_pool.shutdown()
+    image_pool = ImagePool(workers)
+    return image_pool
+
+
+def get_image_pool() -> ImagePool:
+    return image_pool
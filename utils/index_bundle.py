@@ -0,0 +1,525 @@
+from utils.app_types import DesignCase, CaseDatabase, AssetItem, RAW_TEXT_FILTER_CODE, filter_code
+from utils.ann_index import IVFIndex, extend_ivf
+from utils.quantization import QuantizedMatrix, Precision, quantize, stored_rows, has_exact_copy
+from utils.sketch import sign_sketch
+from dataclasses import dataclass
+from collections import OrderedDict
+from pathlib import Path, PureWindowsPath, PurePosixPath
+from datetime import datetime
+from typing import List, Dict, Any, Tuple, Iterable
+import numpy as np
+import pickle
+import shutil
+import json
+import uuid
+import os
+
+
+BUNDLE_FOLDER = "bundle"
+BUNDLE_META_FILE = "meta.json"
+BUNDLE_VERSION = 3
+# cases added and removed after the bundle was saved, one json entry per line
+LOG_FILE = "log.jsonl"
+
+# arrays stored as one .npy file each, opened with mmap_mode='r'.
+# Quantized matrices add <field>_scale.npy (int8) and optionally <field>_exact.npy (float32)
+MATRIX_FIELDS = ["text_embeddings", "text_mm_embeddings", "image_embeddings"]
+ROW_FIELDS = ["text_offsets", "text_row_item", "text_row_filter",
+              "image_offsets", "image_row_item"]
+# optional sign-bit sketches of the text and image rows
+SKETCH_FIELDS = ["text_sketch", "image_sketch"]
+# optional ANN index over the text rows, stored as ann_<field>.npy
+ANN_FIELDS = ["centroids", "list_offsets", "list_rows"]
+
+
+@dataclass
+class IndexBundle:
+    """
+    Columnar index of all cases. The rows of case i are
+    text_offsets[i]:text_offsets[i+1] in the text matrices and
+    image_offsets[i]:image_offsets[i+1] in the image matrix.
+    """
+    cases_meta: List[Dict[str, Any]]   # DesignCase.to_dict() without embeddings
+    text_embeddings: np.ndarray        # (text_rows, dim) float32 or QuantizedMatrix
+    text_mm_embeddings: np.ndarray     # (text_rows, mm_dim) float32 or QuantizedMatrix, ImageBind embeddings of the texts
+    image_embeddings: np.ndarray       # (image_rows, mm_dim) float32 or QuantizedMatrix, L2 normalized
+    text_offsets: np.ndarray           # (case_count + 1, ) int64
+    text_row_item: np.ndarray          # (text_rows, ) int32, content index inside the case
+    text_row_filter: np.ndarray        # (text_rows, ) int8, filter code of the (category, topic) pair
+    image_offsets: np.ndarray          # (case_count + 1, ) int64
+    image_row_item: np.ndarray         # (image_rows, ) int32, content index inside the case
+    index_id: str = None
+    ann: IVFIndex = None               # optional ANN index over text_embeddings
+    text_sketch: np.ndarray = None     # (text_rows, dim / 8) uint8, optional packed sign bits
+    image_sketch: np.ndarray = None    # (image_rows, mm_dim / 8) uint8, optional packed sign bits
+    removed: np.ndarray = None         # (case_count, ) bool, cases removed through the log
+    log_position: int = 0              # bytes of the log applied to this bundle
+
+    @property
+    def case_count(self) -> int:
+        return len(self.cases_meta)
+
+    @property
+    def precision(self) -> Precision:
+        if isinstance(self.text_embeddings, QuantizedMatrix):
+            return self.text_embeddings.precision
+        return "float32"
+
+
+def _as_matrix(rows: List[Any], dim: int) -> np.ndarray:
+    if len(rows) == 0:
+        return np.zeros((0, dim), dtype=np.float32)
+    return np.asarray(np.stack([np.asarray(r, dtype=np.float32) for r in rows]), dtype=np.float32)
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def _has_image_embedding(item) -> bool:
+    return isinstance(item, AssetItem) and item.category != 'text' \
+        and item.multi_modal_embedding is not None and len(item.multi_modal_embedding) > 0
+
+
+def build_bundle(cases: List[DesignCase]) -> IndexBundle:
+    """
+    Concatenate the embeddings of the cases into one columnar bundle
+    """
+    cases_meta = []
+    text_embs, text_mm_embs, image_embs = [], [], []
+    text_offsets, image_offsets = [0], [0]
+    text_row_item, text_row_filter = [], []
+    image_row_item = []
+    dim, mm_dim = 0, 0
+
+    for case in cases:
+        texts = case.get_all_text()
+        if case.embeddings is None or len(case.embeddings) != len(texts):
+            raise ValueError(f"Case {case.name} has no embeddings for its {len(texts)} texts")
+
+        # text rows
+        row_item = np.zeros(len(texts), dtype=np.int32)
+        for item_idx, emb_indices in case.content_to_emb_idx.items():
+            row_item[emb_indices] = item_idx
+        for emb_idx in range(len(texts)):
+            if emb_idx in case.emd_idx_to_filter:
+                text_row_filter.append(filter_code(case.emd_idx_to_filter[emb_idx]))
+            else:
+                text_row_filter.append(RAW_TEXT_FILTER_CODE)
+        text_row_item.extend(row_item.tolist())
+        if len(texts) > 0:
+            dim = case.embeddings.shape[1]
+            text_embs.extend(case.embeddings)
+            if case.multi_modal_embeddings is not None and len(case.multi_modal_embeddings) == len(texts):
+                mm_dim = case.multi_modal_embeddings.shape[1]
+                text_mm_embs.extend(case.multi_modal_embeddings)
+            else:
+                text_mm_embs.extend([None] * len(texts))
+        text_offsets.append(text_offsets[-1] + len(texts))
+
+        # image rows, skip the images whose embedding failed
+        for item_idx, item in enumerate(case.content):
+            if _has_image_embedding(item):
+                mm_dim = len(item.multi_modal_embedding)
+                image_embs.append(item.multi_modal_embedding)
+                image_row_item.append(item_idx)
+        image_offsets.append(len(image_embs))
+
+        case_dict = case.to_dict()
+        for item_dict in case_dict['content']:
+            item_dict.pop('multi_modal_embedding', None)
+        cases_meta.append(case_dict)
+
+    # texts without a multimodal embedding get a zero row
+    text_mm_embs = [np.zeros(mm_dim) if e is None else e for e in text_mm_embs]
+
+    return IndexBundle(
+        cases_meta=cases_meta,
+        text_embeddings=_as_matrix(text_embs, dim),
+        text_mm_embeddings=_as_matrix(text_mm_embs, mm_dim),
+        image_embeddings=_normalize_rows(_as_matrix(image_embs, mm_dim)),
+        text_offsets=np.array(text_offsets, dtype=np.int64),
+        text_row_item=np.array(text_row_item, dtype=np.int32),
+        text_row_filter=np.array(text_row_filter, dtype=np.int8),
+        image_offsets=np.array(image_offsets, dtype=np.int64),
+        image_row_item=np.array(image_row_item, dtype=np.int32),
+        index_id=str(uuid.uuid4()),
+    )
+
+
+def sketch_bundle(bundle: IndexBundle) -> IndexBundle:
+    """
+    Add the sign-bit sketches of the text and image rows, used to prefilter rows by Hamming distance
+    """
+    bundle.text_sketch = sign_sketch(bundle.text_embeddings)
+    bundle.image_sketch = sign_sketch(bundle.image_embeddings)
+    return bundle
+
+
+def quantize_bundle(bundle: IndexBundle, precision: Precision, keep_exact: bool = False) -> IndexBundle:
+    """
+    Store the embedding matrices as float16 or int8, keep_exact also keeps a float32
+    copy of each matrix on disk for the exact rerank
+    """
+    for name in MATRIX_FIELDS:
+        setattr(bundle, name, quantize(getattr(bundle, name), precision, keep_exact))
+    return bundle
+
+
+def _kept_rows(offsets: np.ndarray, keep: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    counts = offsets[keep + 1] - offsets[keep]
+    new_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    rows = np.repeat(offsets[keep] - new_offsets[:-1], counts) + np.arange(new_offsets[-1])
+    return rows, new_offsets
+
+
+def compact_bundle(bundle: IndexBundle) -> IndexBundle:
+    """
+    Bundle without the cases removed through the log and their rows
+    """
+    if bundle.removed is None or not bundle.removed.any():
+        return bundle
+    keep = np.flatnonzero(~bundle.removed)
+    rows, offsets = {}, {}
+    rows['text'], offsets['text'] = _kept_rows(bundle.text_offsets, keep)
+    rows['image'], offsets['image'] = _kept_rows(bundle.image_offsets, keep)
+    arrays = {'text_offsets': offsets['text'], 'image_offsets': offsets['image']}
+    for name in MATRIX_FIELDS:
+        matrix, kept = getattr(bundle, name), _by_row_kind(name, rows)
+        if isinstance(matrix, QuantizedMatrix):
+            arrays[name] = QuantizedMatrix(matrix.data[kept],
+                                           None if matrix.scales is None else matrix.scales[kept],
+                                           None if matrix.exact is None else matrix.exact[kept])
+        else:
+            arrays[name] = np.asarray(matrix[kept])
+    for name in ["text_row_item", "text_row_filter", "image_row_item"] + \
+            (SKETCH_FIELDS if bundle.text_sketch is not None else []):
+        arrays[name] = getattr(bundle, name)[_by_row_kind(name, rows)]
+    ann = None
+    if bundle.ann is not None:
+        # renumber the kept rows, the lists keep their order
+        new_rows = np.full(len(bundle.text_embeddings), -1, dtype=np.int64)
+        new_rows[rows['text']] = np.arange(len(rows['text']))
+        ann = _renumber_ivf(bundle.ann, new_rows[bundle.ann.list_rows])
+    return IndexBundle(cases_meta=[bundle.cases_meta[case_idx] for case_idx in keep],
+                       index_id=str(uuid.uuid4()), ann=ann, **arrays)
+
+
+def save_bundle(bundle: IndexBundle, index_folder_path: str) -> Path:
+    """
+    Write the bundle to <index folder>/bundle, replacing the previous one and its log.
+    Cases removed through the log are left out.
+    """
+    bundle = compact_bundle(bundle)
+    index_folder_path = Path(index_folder_path)
+    index_folder_path.mkdir(parents=True, exist_ok=True)
+    bundle_path = index_folder_path / BUNDLE_FOLDER
+    tmp_path = index_folder_path / f"{BUNDLE_FOLDER}.tmp-{uuid.uuid4().hex[:8]}"
+    tmp_path.mkdir()
+
+    for name in MATRIX_FIELDS:
+        matrix = getattr(bundle, name)
+        np.save(tmp_path / f"{name}.npy", np.ascontiguousarray(stored_rows(matrix)))
+        if isinstance(matrix, QuantizedMatrix) and matrix.scales is not None:
+            np.save(tmp_path / f"{name}_scale.npy", matrix.scales)
+        if isinstance(matrix, QuantizedMatrix) and matrix.exact is not None:
+            np.save(tmp_path / f"{name}_exact.npy", np.ascontiguousarray(matrix.exact))
+    for name in ROW_FIELDS:
+        np.save(tmp_path / f"{name}.npy", np.ascontiguousarray(getattr(bundle, name)))
+    if bundle.text_sketch is not None:
+        for name in SKETCH_FIELDS:
+            np.save(tmp_path / f"{name}.npy", np.ascontiguousarray(getattr(bundle, name)))
+    if bundle.ann is not None:
+        for name in ANN_FIELDS:
+            np.save(tmp_path / f"ann_{name}.npy", np.ascontiguousarray(getattr(bundle.ann, name)))
+
+    meta = {
+        'version': BUNDLE_VERSION,
+        'index_id': bundle.index_id,
+        'case_count': bundle.case_count,
+        'precision': bundle.precision,
+        'sketch': bundle.text_sketch is not None,
+        'cases': bundle.cases_meta,
+    }
+    if bundle.ann is not None:
+        meta['ann'] = {'type': 'ivf', 'list_count': bundle.ann.list_count}
+    # the meta file is written last, a bundle without it is incomplete
+    with open(tmp_path / BUNDLE_META_FILE, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, separators=(',', ':'))
+
+    # swap the folders
+    old_path = index_folder_path / f"{BUNDLE_FOLDER}.old-{uuid.uuid4().hex[:8]}"
+    if bundle_path.exists():
+        bundle_path.rename(old_path)
+    tmp_path.rename(bundle_path)
+    if old_path.exists():
+        shutil.rmtree(old_path, ignore_errors=True)
+    return bundle_path
+
+
+def bundle_exists(index_folder_path: str) -> bool:
+    return (Path(index_folder_path) / BUNDLE_FOLDER / BUNDLE_META_FILE).exists()
+
+
+def read_log(bundle_path: Path, start: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Log entries from byte start on and the position after the last complete entry,
+    a line still being written is read by the next call
+    """
+    log_path = Path(bundle_path) / LOG_FILE
+    if not log_path.exists():
+        return [], start
+    with open(log_path, "rb") as f:
+        f.seek(start)
+        data = f.read()
+    end = data.rfind(b"\n") + 1
+    entries = [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+    return entries, start + end
+
+
+def _apply_log(entries: List[Dict[str, Any]], cases_meta: List[Dict[str, Any]], removed: List[bool]) -> None:
+    for entry in entries:
+        for case_idx in entry['remove']:
+            removed[case_idx] = True
+        if entry['add'] is not None:
+            cases_meta.append(entry['add'])
+            removed.append(False)
+
+
+def _renumber_ivf(ann: IVFIndex, list_rows: np.ndarray) -> IVFIndex:
+    """
+    ANN index with new row numbers for its list rows, rows numbered -1 are dropped
+    """
+    row_lists = np.repeat(np.arange(ann.list_count), np.diff(ann.list_offsets))
+    counts = np.bincount(row_lists[list_rows >= 0], minlength=ann.list_count)
+    return IVFIndex(ann.centroids, np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+                    list_rows[list_rows >= 0])
+
+
+def _by_row_kind(name: str, values: Dict[str, Any]) -> Any:
+    # text_* fields have one row per text row, image_* fields one per image row
+    return values[name.split("_")[0]]
+
+
+def _open_bundle(bundle_path: Path,
+                 cases_meta: List[Dict[str, Any]],
+                 removed: np.ndarray,
+                 log_position: int,
+                 index_id: str,
+                 precision: Precision,
+                 sketch: bool,
+                 ann: bool,
+                 mmap: bool = True,
+                 ) -> IndexBundle:
+    """
+    Open the arrays of the bundle folder for the given cases. The files may hold rows
+    past the last case, left by a patch that did not complete, they are cut off.
+    """
+    mmap_mode = 'r' if mmap else None
+    arrays = {}
+    for name in ["text_offsets", "image_offsets"]:
+        arrays[name] = np.load(bundle_path / f"{name}.npy")[:len(cases_meta) + 1]
+    rows = {'text': int(arrays['text_offsets'][-1]), 'image': int(arrays['image_offsets'][-1])}
+    for name in MATRIX_FIELDS:
+        count = _by_row_kind(name, rows)
+        arrays[name] = np.load(bundle_path / f"{name}.npy", mmap_mode=mmap_mode)[:count]
+        if precision != 'float32':
+            scale_path, exact_path = bundle_path / f"{name}_scale.npy", bundle_path / f"{name}_exact.npy"
+            arrays[name] = QuantizedMatrix(
+                arrays[name],
+                np.load(scale_path)[:count] if scale_path.exists() else None,
+                # the exact copy stays on disk, only the reranked rows are paged in
+                np.load(exact_path, mmap_mode='r')[:count] if exact_path.exists() else None,
+            )
+    for name in ["text_row_item", "text_row_filter", "image_row_item"] + (SKETCH_FIELDS if sketch else []):
+        arrays[name] = np.load(bundle_path / f"{name}.npy")[:_by_row_kind(name, rows)]
+    ann_index = None
+    if ann:
+        ann_index = IVFIndex(**{name: np.load(bundle_path / f"ann_{name}.npy") for name in ANN_FIELDS})
+        if len(ann_index.list_rows) and ann_index.list_rows.max() >= rows['text']:
+            # rows added to the lists by a patch that did not complete
+            ann_index = _renumber_ivf(ann_index, np.where(ann_index.list_rows < rows['text'], ann_index.list_rows, -1))
+    return IndexBundle(cases_meta=cases_meta, index_id=index_id, ann=ann_index,
+                       removed=removed, log_position=log_position, **arrays)
+
+
+def load_bundle(index_folder_path: str, mmap: bool = True) -> IndexBundle:
+    """
+    Open the bundle, the embedding matrices are memory mapped read-only
+    so that processes share a single copy through the page cache.
+    The cases added and removed by patch_bundle are applied from the log.
+    """
+    bundle_path = Path(index_folder_path) / BUNDLE_FOLDER
+    with open(bundle_path / BUNDLE_META_FILE, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get('version') != BUNDLE_VERSION:
+        raise ValueError(f"Unsupported bundle version {meta.get('version')} in {bundle_path}, "
+                         f"rebuild it with preprocess.convert_index")
+
+    cases_meta, removed = meta['cases'], [False] * len(meta['cases'])
+    entries, log_position = read_log(bundle_path)
+    _apply_log(entries, cases_meta, removed)
+    return _open_bundle(bundle_path, cases_meta, np.array(removed, dtype=bool), log_position,
+                        meta['index_id'], meta.get('precision', 'float32'), bool(meta.get('sketch')),
+                        bool(meta.get('ann')), mmap)
+
+
+def _write_rows(npy_path: Path, rows: np.ndarray, start: int) -> None:
+    """
+    Write the rows into the .npy file from row start on, in place, and cut the file after them.
+    np.save leaves room in the header for the row count to grow.
+    """
+    with open(npy_path, "r+b") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        data_offset = f.tell()
+        rows = np.ascontiguousarray(rows, dtype=dtype)
+        if fortran_order or start > shape[0] or (len(rows) and rows.shape[1:] != tuple(shape[1:])):
+            raise ValueError(f"Cannot append {rows.shape} rows at row {start} to {npy_path} of shape {shape}")
+        row_bytes = dtype.itemsize * int(np.prod(shape[1:], dtype=np.int64))
+        f.seek(data_offset + start * row_bytes)
+        f.write(rows.tobytes())
+        f.truncate()
+
+        header = repr({'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False,
+                       'shape': (start + len(rows), ) + tuple(shape[1:])})
+        header_start = 10 if version == (1, 0) else 12
+        header_size = data_offset - header_start
+        if len(header) + 1 > header_size:
+            raise ValueError(f"No room left in the header of {npy_path}")
+        f.seek(header_start)
+        f.write((header.ljust(header_size - 1) + "\n").encode("latin1"))
+
+
+def _save_replace(npy_path: Path, array: np.ndarray) -> None:
+    tmp_path = npy_path.with_name(f"{npy_path.stem}.tmp-{uuid.uuid4().hex[:8]}.npy")
+    np.save(tmp_path, np.ascontiguousarray(array))
+    os.replace(tmp_path, npy_path)
+
+
+def patch_bundle(index_folder_path: str, op: str, add: DesignCase = None, remove: Iterable[int] = ()) -> IndexBundle:
+    """
+    Add a case to the saved bundle and/or mark cases as removed, without rewriting it.
+    The rows of the new case are appended to the array files in place, then one
+    entry is appended to the log, the patch only counts once its entry is complete.
+    Removed cases keep their rows, saving a rebuilt bundle drops them.
+    Only one process may patch a bundle at a time.
+    """
+    bundle_path = Path(index_folder_path) / BUNDLE_FOLDER
+    bundle = load_bundle(index_folder_path)
+    remove = [int(case_idx) for case_idx in remove]
+    for case_idx in remove:
+        if not 0 <= case_idx < bundle.case_count or bundle.removed[case_idx]:
+            raise ValueError(f"Case {case_idx} is not in the bundle {bundle_path}")
+
+    case_dict = None
+    if add is not None:
+        chunk = build_bundle([add])
+        if bundle.text_sketch is not None:
+            chunk = sketch_bundle(chunk)
+        chunk = quantize_bundle(chunk, bundle.precision, has_exact_copy(bundle.text_embeddings))
+        starts = {'text': int(bundle.text_offsets[-1]), 'image': int(bundle.image_offsets[-1])}
+        for name in MATRIX_FIELDS:
+            matrix, start = getattr(chunk, name), _by_row_kind(name, starts)
+            _write_rows(bundle_path / f"{name}.npy", stored_rows(matrix), start)
+            if isinstance(matrix, QuantizedMatrix) and matrix.scales is not None:
+                _write_rows(bundle_path / f"{name}_scale.npy", matrix.scales, start)
+            if isinstance(matrix, QuantizedMatrix) and matrix.exact is not None:
+                _write_rows(bundle_path / f"{name}_exact.npy", matrix.exact, start)
+        for name in ["text_row_item", "text_row_filter", "image_row_item"] + \
+                (SKETCH_FIELDS if bundle.text_sketch is not None else []):
+            _write_rows(bundle_path / f"{name}.npy", getattr(chunk, name), _by_row_kind(name, starts))
+        for name in ["text_offsets", "image_offsets"]:
+            _write_rows(bundle_path / f"{name}.npy", getattr(chunk, name)[1:] + _by_row_kind(name, starts),
+                        bundle.case_count + 1)
+        if bundle.ann is not None and len(chunk.text_embeddings):
+            ann = extend_ivf(bundle.ann, chunk.text_embeddings, starts['text'])
+            for name in ANN_FIELDS:
+                _save_replace(bundle_path / f"ann_{name}.npy", getattr(ann, name))
+        case_dict = chunk.cases_meta[0]
+
+    entries, _ = read_log(bundle_path)
+    entry = {'seq': len(entries) + 1, 'op': op, 'time': datetime.now().isoformat(timespec="seconds"),
+             'add': case_dict, 'remove': remove}
+    with open(bundle_path / LOG_FILE, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    return load_bundle(index_folder_path)
+
+
+def _attach_case(bundle: IndexBundle, case_idx: int, case: DesignCase) -> None:
+    case.get_all_text()
+    t0, t1 = bundle.text_offsets[case_idx], bundle.text_offsets[case_idx + 1]
+    case.embeddings = stored_rows(bundle.text_embeddings)[t0:t1]
+    case.multi_modal_embeddings = stored_rows(bundle.text_mm_embeddings)[t0:t1]
+    i0, i1 = bundle.image_offsets[case_idx], bundle.image_offsets[case_idx + 1]
+    for row in range(i0, i1):
+        case.content[bundle.image_row_item[row]].multi_modal_embedding = stored_rows(bundle.image_embeddings)[row]
+
+
+def _case_database(bundle: IndexBundle, segments: List[DesignCase]) -> CaseDatabase:
+    database_cases = OrderedDict()
+    for case_idx, case in enumerate(segments):
+        if bundle.removed is None or not bundle.removed[case_idx]:
+            database_cases[case.case_id] = case
+    return CaseDatabase(database_cases, index=bundle, segments=segments)
+
+
+def bundle_to_database(bundle: IndexBundle, cases: List[DesignCase] = None) -> CaseDatabase:
+    """
+    Create the CaseDatabase, the embeddings of each case are views into the bundle matrices,
+    as stored, so quantized bundles give quantized views.
+    If cases are not given, they are rebuilt from the bundle metadata.
+    """
+    if cases is None:
+        cases = [DesignCase.from_dict(case_dict) for case_dict in bundle.cases_meta]
+    for case_idx, case in enumerate(cases):
+        _attach_case(bundle, case_idx, case)
+    return _case_database(bundle, list(cases))
+
+
+def extend_database(database: CaseDatabase, index_folder_path: str) -> CaseDatabase:
+    """
+    Apply the log entries written since the database was loaded. Only the added cases
+    are built, the others are shared with the given database, which stays usable.
+    Return the given database if the log did not grow.
+    """
+    bundle: IndexBundle = database.index
+    bundle_path = Path(index_folder_path) / BUNDLE_FOLDER
+    entries, log_position = read_log(bundle_path, bundle.log_position)
+    if not entries:
+        return database
+    cases_meta, removed = list(bundle.cases_meta), bundle.removed.tolist()
+    _apply_log(entries, cases_meta, removed)
+    new_bundle = _open_bundle(bundle_path, cases_meta, np.array(removed, dtype=bool), log_position,
+                              bundle.index_id, bundle.precision, bundle.text_sketch is not None,
+                              bundle.ann is not None)
+    segments = list(database.case_list())
+    for case_idx in range(len(segments), len(cases_meta)):
+        case = DesignCase.from_dict(cases_meta[case_idx])
+        _attach_case(new_bundle, case_idx, case)
+        segments.append(case)
+    return _case_database(new_bundle, segments)
+
+
+class _PortableUnpickler(pickle.Unpickler):
+    """
+    Pickles written on Windows contain WindowsPath objects that cannot be
+    instantiated on other platforms, load them as pure paths instead
+    """
+    def find_class(self, module, name):
+        if module == "pathlib" and name == "WindowsPath":
+            return PureWindowsPath
+        if module == "pathlib" and name == "PosixPath":
+            return PurePosixPath
+        return super().find_class(module, name)
+
+
+def load_case_pickle(pkl_path: str) -> DesignCase:
+    with open(pkl_path, "rb") as f:
+        return _PortableUnpickler(f).load()
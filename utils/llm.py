@@ -1,14 +1,16 @@
 from __future__ import annotations
 import os
 import logging
-import base64
-import requests
-from openai import OpenAI
 from dataclasses import dataclass, field
 from typing import Literal, TypedDict, Union
+from utils.providers import get_provider
 
 
 MessageRole = Literal["system", "user", "assistant"]
+EMBEDDING_MODEL = "text-embedding-3-large"
+CHAT_MODEL = "gpt-4o"
+VISION_MODEL = "gpt-4o-2024-08-06"
+EMBEDDING_DIMENSIONS = 1024
 
 
 class MessageDict(TypedDict):
@@ -62,19 +64,20 @@ class LLMHandler:
     llm_model = None
     record_messages = False
     record_file = None
-    client = None
+    provider = None
     log_count = 0
     prompt_token_usage = 0
     completion_token_usage = 0
     embedding_token_usage = 0
 
-    def __init__(self, llm_model: str = "gpt-4o", 
+    def __init__(self, llm_model: str = CHAT_MODEL, 
                  record_messages: bool = False, 
                  log_folder: str = 'llm_logs'):
         self.llm_model = llm_model
         self.record_messages = record_messages
         self.log_folder = log_folder
-        self.client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"),)
+        # OpenAI unless another provider is configured in utils.providers
+        self.provider = get_provider()
         
         # create the log folder if it doesn't exist
         if not os.path.exists(self.log_folder) and self.record_messages:
@@ -97,18 +100,14 @@ class LLMHandler:
         self.save_messages(messages)
 
         try:
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=messages,
-                **kwargs
-                )
+            reply = self.provider.chat(messages, model, **kwargs)
         except Exception as err:
             logging.error(f'OPENAI ERROR: {err}')
             raise err
 
-        content = response.choices[0].message.content
-        self.prompt_token_usage += response.usage.prompt_tokens
-        self.completion_token_usage += response.usage.completion_tokens
+        content = reply.content
+        self.prompt_token_usage += reply.prompt_tokens
+        self.completion_token_usage += reply.completion_tokens
 
         self.save_messages([{"role": "assistant", "content": content}])
         return content
@@ -124,78 +123,23 @@ class LLMHandler:
 
     def get_text_embeddings_multi(self, texts: list[str]) -> list[list[float]]:
         """
-        Get the text embeddings from the OpenAI API.
+        Get the text embeddings from the configured provider, the OpenAI API by default.
         """
         # assert the input is a list of strings
         assert all(isinstance(text, str) for text in texts)
 
-        client = self.client
+        reply = self.provider.text_embeddings(texts, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
 
-        response = client.embeddings.create(
-            input=texts,
-            model="text-embedding-3-large",
-            dimensions=1024,
-        )
+        self.embedding_token_usage += reply.tokens
 
-        self.embedding_token_usage += response.usage.prompt_tokens
-
-        return [r.embedding for r in response.data]
+        return reply.embeddings
     
     def get_text_embeddings(self, text: str) -> list[float]:
         return self.get_text_embeddings_multi([text])[0]
 
 
-def call_gpt_v(image_path: str, prompt: str) -> dict:
+def call_gpt_v(image_path: str, prompt: str) -> str:
     """
-    Calls the OpenAI GPT-4 Vision API to generate a response to the prompt and image.
+    Calls the GPT-4 Vision model of the configured provider to generate a response to the prompt and image.
     """
-    # OpenAI API Key
-    api_key = os.environ.get("OPENAI_API_KEY")
-
-    # Function to encode the image
-    def encode_image(image_path):
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
-
-    # Getting the base64 string
-    base64_image = encode_image(image_path)
-
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
-    }
-
-    payload = {
-        "model": "gpt-4o-2024-08-06",
-        "messages": [
-        {
-            "role": "user",
-            "content": [
-            {
-                "type": "text",
-                "text": prompt
-            },
-            {
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/jpeg;base64,{base64_image}",
-                    "detail": "high"
-                }
-            }
-            ]
-        }
-        ],
-        "max_tokens": 2000,
-    }
-
-    response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
-
-    response =  response.json()
-
-    if response.get("id"):
-        text_str =  response["choices"][0]['message']['content']
-        return text_str
-    else:
-        # raise an error if the response is not successful
-        raise ValueError(response)
-    
+    return get_provider().vision(image_path, prompt, VISION_MODEL)
@@ -0,0 +1,38 @@
+from typing import Dict
+import threading
+
+
+# maximum number of requests in flight to each provider, shared by all threads of the process
+DEFAULT_PROVIDER_LIMITS = {
+    "openai": 16,
+    "replicate": 8,
+}
+
+_limits: Dict[str, int] = dict(DEFAULT_PROVIDER_LIMITS)
+_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+_lock = threading.Lock()
+
+
+def configure_provider_limits(limits: Dict[str, int]) -> None:
+    """
+    Set the concurrency limit of the given providers, call it before the requests start
+    """
+    with _lock:
+        for provider, limit in limits.items():
+            if limit is None:
+                continue
+            _limits[provider] = max(1, int(limit))
+            _semaphores.pop(provider, None)
+
+
+def provider_slot(provider: str) -> threading.BoundedSemaphore:
+    """
+    Semaphore of the provider, hold it around every request:
+
+        with provider_slot("openai"):
+            client.embeddings.create(...)
+    """
+    with _lock:
+        if provider not in _semaphores:
+            _semaphores[provider] = threading.BoundedSemaphore(_limits.get(provider, 1))
+        return _semaphores[provider]
@@ -0,0 +1,288 @@
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Type
+from pathlib import Path
+import numpy as np
+import hashlib
+import json
+import time
+import os
+import re
+from utils.provider_limits import provider_slot
+from utils.rate_limit import get_rate_limiter, call_with_backoff
+from utils.image_cache import get_image_cache
+from utils.http_clients import get_session, get_openai_client, get_replicate_client, http_timeout
+
+
+class ChatReply(NamedTuple):
+    content: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+
+class EmbeddingReply(NamedTuple):
+    embeddings: List[List[float]]
+    tokens: int = 0
+
+
+class ModelProvider(ABC):
+    """
+    Backend of the model calls made by LLMHandler, call_gpt_v and get_single_embedding.
+    The model names are passed in by the callers so that a provider only decides how they are served.
+    A provider that misses one of the abstract methods cannot be created.
+    """
+    name = "base"
+
+    @abstractmethod
+    def chat(self, messages: List[dict], model: str, **kwargs) -> ChatReply:
+        raise NotImplementedError
+
+    @abstractmethod
+    def vision(self, image_path: str, prompt: str, model: str, max_tokens: int = 2000) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def text_embeddings(self, texts: List[str], model: str, dimensions: int) -> EmbeddingReply:
+        raise NotImplementedError
+
+    @abstractmethod
+    def multi_modal_embedding(self, input_dict: dict, model: str) -> List[float]:
+        raise NotImplementedError
+
+    def cache_model(self, model: str) -> str:
+        """
+        Model name under which the responses and embeddings of this provider are cached
+        """
+        return model
+
+
+class OpenAIProvider(ModelProvider):
+    """
+    OpenAI for the chat, vision and text embedding calls, Replicate for the ImageBind embeddings.
+    All calls go through the shared clients of utils.http_clients, which keep their connections alive.
+    """
+    name = "openai"
+
+    @property
+    def client(self):
+        return get_openai_client()
+
+    def chat(self, messages: List[dict], model: str, **kwargs) -> ChatReply:
+        with provider_slot("openai"):
+            response = self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                **kwargs
+                )
+        return ChatReply(response.choices[0].message.content,
+                         response.usage.prompt_tokens,
+                         response.usage.completion_tokens)
+
+    def vision(self, image_path: str, prompt: str, model: str, max_tokens: int = 2000) -> str:
+        # Getting the base64 string of the image downscaled to the resolution GPT-V works at
+        base64_image = get_image_cache().vision_base64(image_path)
+
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {os.environ.get('OPENAI_API_KEY')}"
+        }
+
+        payload = {
+            "model": model,
+            "messages": [
+            {
+                "role": "user",
+                "content": [
+                {
+                    "type": "text",
+                    "text": prompt
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{base64_image}",
+                        "detail": "high"
+                    }
+                }
+                ]
+            }
+            ],
+            "max_tokens": max_tokens,
+        }
+
+        with provider_slot("openai"):
+            response = get_session().post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload,
+                                          timeout=http_timeout())
+
+        response = response.json()
+
+        if response.get("id"):
+            return response["choices"][0]['message']['content']
+        else:
+            # raise an error if the response is not successful
+            raise ValueError(response)
+
+    def text_embeddings(self, texts: List[str], model: str, dimensions: int) -> EmbeddingReply:
+        with provider_slot("openai"):
+            response = self.client.embeddings.create(
+                input=texts,
+                model=model,
+                dimensions=dimensions,
+            )
+        return EmbeddingReply([r.embedding for r in response.data], response.usage.prompt_tokens)
+
+    def multi_modal_embedding(self, input_dict: dict, model: str) -> List[float]:
+        def run():
+            with provider_slot("replicate"):
+                return get_replicate_client().run(
+                    model,
+                    input=input_dict
+                )
+
+        # throttled calls wait for the shared rate limiter instead of failing
+        return call_with_backoff(run, get_rate_limiter("replicate"))
+
+
+# dimensions of the ImageBind embeddings
+MULTI_MODAL_DIMENSIONS = 1024
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+# words the local provider writes its inquiry answers with
+_LOCAL_VOCABULARY = [
+    "brick", "concrete", "timber", "glass", "steel", "stone", "courtyard", "atrium", "facade",
+    "cantilever", "roof", "terrace", "column", "arch", "vault", "ramp", "stair", "canopy",
+    "light", "shadow", "rhythm", "texture", "proportion", "scale", "symmetry", "void", "mass",
+    "landscape", "street", "garden", "river", "hill", "city", "village", "coast", "forest",
+    "calm", "bold", "monolithic", "playful", "austere", "warm", "open", "intimate", "modular",
+]
+
+_ASPECT_BLOCK = re.compile(r"Cover the following aspects:[ \t]*\n(.*?)\n- ", re.DOTALL)
+_ASPECT_LINE = re.compile(r"^\s+- ([^:\n]+?)(?::\s*(.*))?$")
+
+
+@lru_cache(maxsize=8192)
+def word_vector(word: str, model: str, dimensions: int) -> np.ndarray:
+    """
+    Random vector seeded by the model and the word
+    """
+    seed = int.from_bytes(hashlib.sha256(f"{model}\0{word}".encode("utf-8")).digest()[:8], "little")
+    return np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+
+
+def hash_embedding(text: str, model: str, dimensions: int) -> List[float]:
+    """
+    Unit vector of the text, the sum of one seeded random vector per word,
+    texts sharing words get close vectors. Each model has its own vectors.
+    """
+    words = _WORD_PATTERN.findall(text.lower()) or [text]
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in words:
+        vector += word_vector(word, model, dimensions)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def bytes_embedding(content: bytes, model: str, dimensions: int) -> List[float]:
+    """
+    Unit vector seeded by the hash of the bytes
+    """
+    seed = int.from_bytes(hashlib.sha256(model.encode("utf-8") + b"\0" + content).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class LocalProvider(ModelProvider):
+    """
+    Offline stand-in for benchmarks and load tests, no network and no cost.
+    Embeddings are deterministic hash vectors and inquiries get templated json answers
+    for the aspects listed in the prompt. Every call sleeps latency seconds to mimic a remote model.
+    """
+    name = "local"
+
+    def __init__(self, latency: float = 0.0, multi_modal_dimensions: int = MULTI_MODAL_DIMENSIONS):
+        self.latency = float(latency or 0.0)
+        self.multi_modal_dimensions = multi_modal_dimensions
+
+    def _wait(self) -> None:
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def cache_model(self, model: str) -> str:
+        # keep the stand-in answers apart from the real ones in the shared caches
+        return f"local/{model}"
+
+    @staticmethod
+    def _answer(prompt: str, content: bytes) -> str:
+        """
+        Templated inquiry json, the answer lists for the inquiries of the cases,
+        content and weight dicts when the prompt asks for weights like the image queries do
+        """
+        digest = hashlib.sha256(prompt.encode("utf-8") + b"\0" + content).digest()
+        rng = np.random.default_rng(int.from_bytes(digest[:8], "little"))
+        weighted = '"weight"' in prompt
+        block = _ASPECT_BLOCK.search(prompt)
+        analysis = {}
+        for line in (block.group(1).splitlines() if block else []):
+            match = _ASPECT_LINE.match(line)
+            if match is None:
+                continue
+            theme, question = match.group(1).strip(), match.group(2) or ""
+            if "Choose from:" in question:
+                choices = [c.strip() for c in question.split("Choose from:")[-1].split(",") if c.strip()]
+                analysis[theme] = choices[rng.integers(len(choices))]
+                continue
+            sentences = []
+            for _ in range(rng.integers(1, 4)):
+                words = rng.choice(_LOCAL_VOCABULARY, size=4, replace=False)
+                sentences.append(f"The {theme} combines {words[0]} and {words[1]} with a {words[2]} {words[3]}.")
+            if weighted:
+                analysis[theme] = {"content": " ".join(sentences), "weight": round(float(rng.uniform(0.5, 1.0)), 2)}
+            else:
+                analysis[theme] = sentences
+        return f"```json\n{json.dumps({'analysis': analysis}, indent=2)}\n```"
+
+    def chat(self, messages: List[dict], model: str, **kwargs) -> ChatReply:
+        self._wait()
+        prompt = "\n".join(str(message["content"]) for message in messages)
+        return ChatReply(self._answer(prompt, b""))
+
+    def vision(self, image_path: str, prompt: str, model: str, max_tokens: int = 2000) -> str:
+        self._wait()
+        # the same image preparation as a remote vision call, so that builds cost the same CPU
+        return self._answer(prompt, get_image_cache().vision_base64(image_path).encode("ascii"))
+
+    def text_embeddings(self, texts: List[str], model: str, dimensions: int) -> EmbeddingReply:
+        self._wait()
+        return EmbeddingReply([hash_embedding(text, model, dimensions) for text in texts])
+
+    def multi_modal_embedding(self, input_dict: dict, model: str) -> List[float]:
+        self._wait()
+        if "text_input" in input_dict:
+            return hash_embedding(input_dict["text_input"], model, self.multi_modal_dimensions)
+        image = input_dict["input"]
+        content = image.getvalue() if hasattr(image, "getvalue") else Path(image).read_bytes()
+        return bytes_embedding(content, model, self.multi_modal_dimensions)
+
+
+PROVIDERS: Dict[str, Type[ModelProvider]] = {
+    "openai": OpenAIProvider,
+    "local": LocalProvider,
+}
+
+# process wide provider, OpenAI and Replicate unless configured otherwise
+provider: ModelProvider = OpenAIProvider()
+
+
+def configure_provider(name: str = "openai", **options) -> ModelProvider:
+    """
+    Select the provider by name, options go to its constructor (latency for the local provider)
+    """
+    global provider
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown provider {name}, choose from {', '.join(PROVIDERS)}")
+    provider = PROVIDERS[name](**options)
+    return provider
+
+
+def get_provider() -> ModelProvider:
+    return provider
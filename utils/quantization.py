@@ -0,0 +1,93 @@
+from dataclasses import dataclass
+from typing import Literal, Tuple
+import numpy as np
+
+
+Precision = Literal["float32", "float16", "int8"]
+PRECISIONS = ("float32", "float16", "int8")
+
+# rows converted to float32 at a time, small enough to stay in the cache
+BLOCK_ROWS = 4096
+
+
+@dataclass
+class QuantizedMatrix:
+    """
+    Embedding matrix stored as float16, or as int8 with a per-row scale (row = data * scale).
+    Indexing returns dequantized float32 rows, the product with a vector is computed
+    block by block so the full float32 matrix is never materialized.
+    """
+    data: np.ndarray           # (rows, dim) float16 or int8
+    scales: np.ndarray = None  # (rows, ) float32, int8 only
+    exact: np.ndarray = None   # (rows, dim) float32, optional copy for the exact rerank
+
+    @property
+    def precision(self) -> Precision:
+        return "int8" if self.data.dtype == np.int8 else "float16"
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.data.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes + (0 if self.scales is None else self.scales.nbytes)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __getitem__(self, key) -> np.ndarray:
+        rows = np.asarray(self.data[key], dtype=np.float32)
+        if self.scales is not None:
+            scales = np.asarray(self.scales[key], dtype=np.float32)
+            rows = rows * (scales[..., None] if rows.ndim > scales.ndim else scales)
+        return rows
+
+    def __matmul__(self, vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        scores = np.empty(len(self.data), dtype=np.float32)
+        for start in range(0, len(self.data), BLOCK_ROWS):
+            block = self.data[start:start + BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ vector
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+
+def quantize(matrix: np.ndarray, precision: Precision, keep_exact: bool = False):
+    """
+    Store a float32 matrix at the given precision, float32 returns the matrix unchanged.
+    int8 uses a symmetric per-row scale max(|row|) / 127.
+    """
+    if precision == "float32":
+        return matrix
+    matrix = np.asarray(matrix, dtype=np.float32)
+    exact = matrix if keep_exact else None
+    if precision == "float16":
+        return QuantizedMatrix(matrix.astype(np.float16), exact=exact)
+    if precision == "int8":
+        scales = np.abs(matrix).max(axis=1, initial=0) / 127
+        safe_scales = np.where(scales == 0, 1, scales)
+        data = np.clip(np.rint(matrix / safe_scales[:, None]), -127, 127).astype(np.int8)
+        return QuantizedMatrix(data, scales.astype(np.float32), exact)
+    raise ValueError(f"Unknown precision {precision}, expected one of {PRECISIONS}")
+
+
+def stored_rows(matrix) -> np.ndarray:
+    """
+    Rows as stored, without dequantization, used for per-case views
+    """
+    return matrix.data if isinstance(matrix, QuantizedMatrix) else matrix
+
+
+def exact_rows(matrix, key) -> np.ndarray:
+    """
+    float32 rows from the exact copy if the matrix keeps one, otherwise dequantized
+    """
+    if isinstance(matrix, QuantizedMatrix) and matrix.exact is not None:
+        return np.array(matrix.exact[key], dtype=np.float32)
+    return np.array(matrix[key], dtype=np.float32)
+
+
+def has_exact_copy(matrix) -> bool:
+    return isinstance(matrix, QuantizedMatrix) and matrix.exact is not None
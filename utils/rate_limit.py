@@ -0,0 +1,142 @@
+from typing import Callable, Dict, Optional, Tuple, TypeVar
+import threading
+import logging
+import random
+import time
+import re
+
+
+T = TypeVar("T")
+
+# requests per second allowed by each provider, Replicate allows 600 predictions per minute
+DEFAULT_RATES = {
+    "replicate": 10.0,
+}
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all threads calling one provider, rate tokens per second up to burst.
+    A throttled response pauses every caller until its Retry-After and halves the rate
+    (once per pause), the rate then climbs back linearly to the allowed rate within recovery_seconds.
+    """
+    def __init__(self, rate: float, burst: int = None, min_rate: float = None, recovery_seconds: float = 60.0):
+        self.max_rate = rate
+        self.recovery_seconds = recovery_seconds
+        self.rate = rate
+        self.min_rate = min_rate or rate / 16
+        self.burst = burst or max(1, int(rate))
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.throttle_count = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            elapsed = now - self.updated
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+            self.rate = min(self.max_rate, self.rate + elapsed * self.max_rate / self.recovery_seconds)
+            self.updated = now
+
+    def acquire(self) -> None:
+        """
+        Block until the provider accepts one more request
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_throttle(self, retry_after: Optional[float] = None) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self.throttle_count += 1
+            # the other requests of the same burst are throttled too, only the first one lowers the rate
+            if now >= self.paused_until:
+                self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0.0
+            self.paused_until = max(self.paused_until, now + (retry_after or 1 / self.rate))
+            # no tokens accumulate during the pause
+            self.updated = max(now, self.paused_until)
+
+
+def backoff_delay(attempt: int, base_delay: float = 1.0, max_delay: float = 60.0) -> float:
+    """
+    Exponential backoff with full jitter, uniform in [0, min(max_delay, base_delay * 2^attempt)]
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def throttle_info(error: Exception) -> Tuple[bool, Optional[float]]:
+    """
+    Whether the error is a 429 response, and its Retry-After in seconds if known.
+    Replicate errors carry the status but not the headers, their detail reads
+    "... Expected available in 5 seconds."
+    """
+    response = getattr(error, "response", None)
+    status = getattr(error, "status", None) or getattr(response, "status_code", None)
+    if status != 429:
+        return False, None
+    headers = getattr(response, "headers", None) or {}
+    retry_after = headers.get("Retry-After") if hasattr(headers, "get") else None
+    if retry_after is not None and str(retry_after).strip().replace(".", "", 1).isdigit():
+        return True, float(retry_after)
+    match = re.search(r"available in ~?(\d+(?:\.\d+)?) second", str(getattr(error, "detail", "") or error))
+    return True, float(match.group(1)) if match else None
+
+
+def call_with_backoff(fn: Callable[[], T],
+                      limiter: RateLimiter,
+                      max_attempts: int = 6,
+                      base_delay: float = 1.0,
+                      max_delay: float = 60.0,
+                      ) -> T:
+    """
+    Call fn once the limiter allows it, retry throttled calls with jittered exponential backoff.
+    Other errors are raised right away.
+    """
+    for attempt in range(max_attempts):
+        limiter.acquire()
+        try:
+            result = fn()
+        except Exception as e:
+            throttled, retry_after = throttle_info(e)
+            if not throttled or attempt == max_attempts - 1:
+                raise
+            logging.warning(f"Throttled, retry after {retry_after or 'backoff'} s (attempt {attempt + 1})")
+            limiter.on_throttle(retry_after)
+            time.sleep(backoff_delay(attempt, base_delay, max_delay))
+            continue
+        return result
+
+
+_rates: Dict[str, float] = dict(DEFAULT_RATES)
+_limiters: Dict[str, RateLimiter] = {}
+_lock = threading.Lock()
+
+
+def configure_rate_limits(rates: Dict[str, float]) -> None:
+    """
+    Set the allowed requests per second of the given providers, call it before the requests start
+    """
+    with _lock:
+        for provider, rate in rates.items():
+            if rate is None:
+                continue
+            _rates[provider] = float(rate)
+            _limiters.pop(provider, None)
+
+
+def get_rate_limiter(provider: str) -> RateLimiter:
+    with _lock:
+        if provider not in _limiters:
+            _limiters[provider] = RateLimiter(_rates.get(provider, 1.0))
+        return _limiters[provider]
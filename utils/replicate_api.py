@@ -1,75 +1,34 @@
-import replicate
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Union, Literal, TypedDict, Optional
 from enum import Enum
 import logging
 from tqdm import tqdm
 from pathlib import Path
-from PIL import Image
 import io
-import os
+from utils.providers import get_provider
+from utils.image_cache import get_image_cache
+from utils.rate_limit import backoff_delay
+import time
+
+IMAGEBIND_MODEL = "daanelson/imagebind:0383f62e173dc821ec52663ed22a076d9c970549c209666ac3db181618b7a304"
 
 class ModalityType(str, Enum):
     TEXT = "text"
     IMAGE = "vision"
 
 class EmbeddingInput(TypedDict):
-    input_data: Union[str, Path, io.BytesIO]
+    input_data: Union[str, Path, io.BytesIO, bytes]
     modality: ModalityType
 
 def resize_image_if_needed(image_path: Union[str, Path], max_size_kb: int = 256) -> io.BytesIO:
     """
-    Resize image if it's larger than max_size_kb.
-    Returns BytesIO object containing the (potentially resized) image.
+    Image downscaled once to the ImageBind resolution and encoded once, at most max_size_kb.
+    Unchanged images come from the image cache.
+    Returns BytesIO object containing the prepared image.
     """
-    max_size_bytes = max_size_kb * 1024
-    
-    # Check original file size
-    file_size = os.path.getsize(image_path)
-    
-    # Open the image
-    with Image.open(image_path) as img:
-        # Convert to RGB if necessary (handles PNG with transparency)
-        if img.mode in ('RGBA', 'P'):
-            img = img.convert('RGB')
-        
-        # If file is already small enough, just return it
-        if file_size <= max_size_bytes:
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='JPEG', quality=95)
-            img_byte_arr.seek(0)
-            return img_byte_arr
-        
-        # Calculate scaling factor
-        scale = (max_size_bytes / file_size) ** 0.5
-        
-        # Start with 90% quality
-        quality = 90
-        
-        while True:
-            # Resize image
-            new_width = int(img.width * scale)
-            new_height = int(img.height * scale)
-            resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # Save to BytesIO
-            img_byte_arr = io.BytesIO()
-            resized_img.save(img_byte_arr, format='JPEG', quality=quality)
-            
-            # Check new size
-            new_size = img_byte_arr.tell()
-            
-            if new_size <= max_size_bytes:
-                img_byte_arr.seek(0)
-                return img_byte_arr
-            
-            # If still too large, reduce quality or scale
-            if quality > 30:
-                quality -= 10
-            else:
-                scale *= 0.9
+    return io.BytesIO(get_image_cache().prepared_image(image_path, max_bytes=max_size_kb * 1024))
 
-def get_single_embedding(input_data: Union[str, Path, io.BytesIO], modality: ModalityType) -> Optional[List[float]]:
+def get_single_embedding(input_data: Union[str, Path, io.BytesIO, bytes], modality: ModalityType) -> Optional[List[float]]:
     """Get embeddings for a single input (text or image)."""
     try:
         if modality == ModalityType.TEXT:
@@ -85,16 +44,20 @@ def get_single_embedding(input_data: Union[str, Path, io.BytesIO], modality: Mod
                     "input": img_data,
                     "modality": "vision"
                 }
+            elif isinstance(input_data, bytes):
+                # prepared image, a fresh stream for every attempt
+                input_dict = {
+                    "input": io.BytesIO(input_data),
+                    "modality": "vision"
+                }
             else:  # Already a BytesIO object
                 input_dict = {
                     "input": input_data,
                     "modality": "vision"
                 }
         
-        output = replicate.run(
-            "daanelson/imagebind:0383f62e173dc821ec52663ed22a076d9c970549c209666ac3db181618b7a304",
-            input=input_dict
-        )
+        # Replicate unless another provider is configured in utils.providers
+        output = get_provider().multi_modal_embedding(input_dict, IMAGEBIND_MODEL)
         return output
     except Exception as e:
         logging.error(f"Error processing input: {str(e)}")
@@ -110,25 +73,22 @@ def get_embeddings_batch(
     logging.basicConfig(level=logging.INFO)
     logger = logging.getLogger(__name__)
     results = {}
-    
-    from retrying import retry
 
-    # set a long wait time to get around rate limits
-    @retry(stop_max_attempt_number=retry_attempts, wait_fixed=30*1000)
+    # rate limits are handled by the shared limiter inside the provider,
+    # other failures are retried after a short jittered backoff
     def process_input(args):
         idx, input_item = args
-        try:
+        for attempt in range(retry_attempts):
             embedding = get_single_embedding(
                 input_data=input_item['input_data'],
                 modality=input_item['modality']
             )
             if embedding is not None:
                 return idx, embedding
-            else:
-                raise Exception("Failed to get embedding, retrying...")
-        except Exception as e:
-            logger.error(f"Error processing input {idx}: {str(e)}, retrying...")
-            raise Exception(f"Error processing input {idx}: {str(e)}, retrying...")
+            if attempt < retry_attempts - 1:
+                logger.error(f"Error processing input {idx}, retrying...")
+                time.sleep(backoff_delay(attempt))
+        raise Exception(f"Failed to get embedding for input {idx}")
     
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
         future_to_idx = {
@@ -221,6 +181,14 @@ def batch_image_embeddings(
             for path in image_paths
         ]
     
+    # decode and downscale the images not in the image cache in the process pool, the threads only send them
+    prepared = get_image_cache().prepared_images([item['input_data'] for item in valid_inputs],
+                                                 max_bytes=max_size_kb * 1024)
+    valid_inputs = [
+        {"input_data": image_bytes, "modality": ModalityType.IMAGE} if image_bytes is not None else item
+        for item, image_bytes in zip(valid_inputs, prepared)
+    ]
+
     return get_embeddings_batch(
         inputs=valid_inputs,
         max_workers=max_workers,
@@ -0,0 +1,65 @@
+from utils.disk_cache import DiskCache
+from pathlib import Path
+from typing import Optional, Dict, Union
+import threading
+import hashlib
+
+
+def content_hash(content: Union[str, bytes]) -> str:
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent cache of model responses keyed by
+    (model, hash of the prompt, hash of the image bytes or text).
+    Without a directory nothing is stored and every lookup misses.
+    """
+    def __init__(self, directory: Optional[str] = None):
+        self.store = DiskCache(Path(directory) / "responses.sqlite") if directory else None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, prompt: str, content: Union[str, bytes]) -> str:
+        return content_hash("\0".join([model, content_hash(prompt), content_hash(content)]))
+
+    def get(self, model: str, prompt: str, content: Union[str, bytes]) -> Optional[str]:
+        value = self.store.get(self.make_key(model, prompt, content)) if self.store is not None else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return value.decode("utf-8")
+
+    def put(self, model: str, prompt: str, content: Union[str, bytes], response: str) -> None:
+        if self.store is not None:
+            self.store.put(self.make_key(model, prompt, content), response.encode("utf-8"))
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self.store) if self.store is not None else 0,
+            }
+
+
+# process wide cache used by the asset inquiries, disabled until configured
+response_cache = ResponseCache()
+
+
+def configure_response_cache(directory: Optional[str] = None) -> ResponseCache:
+    global response_cache
+    response_cache = ResponseCache(directory)
+    return response_cache
+
+
+def get_response_cache() -> ResponseCache:
+    return response_cache
@@ -0,0 +1,49 @@
+import numpy as np
+
+
+# popcount of every byte, used where np.bitwise_count is not available (numpy < 2.0)
+_BYTE_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+def sign_sketch(matrix: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+    """
+    Pack the sign bit of every value, a 1024-d row becomes 128 bytes, shape: (rows, ceil(dim / 8))
+    """
+    sketch = np.zeros((len(matrix), (matrix.shape[1] + 7) // 8), dtype=np.uint8)
+    for start in range(0, len(matrix), batch_size):
+        batch = np.asarray(matrix[start:start + batch_size], dtype=np.float32)
+        sketch[start:start + len(batch)] = np.packbits(batch > 0, axis=1)
+    return sketch
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _BYTE_POPCOUNT[values]
+
+
+def hamming_distances(sketch: np.ndarray, query: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+    """
+    Hamming distance between the sign sketch of the query and the sketch of each row
+    """
+    query_sketch = np.packbits(np.asarray(query, dtype=np.float32) > 0)
+    sketch = sketch if rows is None else sketch[rows]
+    if sketch.shape[1] % 8 == 0 and hasattr(np, "bitwise_count"):
+        # popcount on 64-bit words, 8 times fewer elements than bytes.
+        # The byte table of older numpy versions only covers uint8 values
+        sketch, query_sketch = sketch.view(np.uint64), query_sketch.view(np.uint64)
+    return _popcount(sketch ^ query_sketch).sum(axis=1, dtype=np.int32)
+
+
+def hamming_shortlist(sketch: np.ndarray, query: np.ndarray, shortlist: int, rows: np.ndarray = None) -> np.ndarray:
+    """
+    The shortlist rows closest to the query in Hamming distance, sorted ascending.
+    rows restricts the search to these rows, all rows if None.
+    """
+    distances = hamming_distances(sketch, query, rows)
+    if shortlist < len(distances):
+        selected = np.argpartition(distances, shortlist - 1)[:shortlist]
+    else:
+        selected = np.arange(len(distances))
+    selected = selected if rows is None else rows[selected]
+    return np.sort(selected)